@@ -0,0 +1,410 @@
+"""Run the SDB pipeline without the GUI.
+
+Jobs come from JSON config files (a single job object, a list of jobs or
+{"jobs": [...]}) or from the command line arguments, e.g.
+
+    python sdb_batch.py nightly.json
+    python sdb_batch.py --image scene.tif --samples a.csv b.csv --output depth.tif --depth depth
+    python sdb_batch.py --model rf.joblib --images 'scenes/*.tif' --output-dir depths
+"""
+import argparse
+import datetime
+import glob
+import json
+import multiprocessing
+import os
+import sys
+from sdb_raster import COMPRESSIONS, DEFAULT_MEMORY_BUDGET, DEPTH_TYPES
+from sdb_cache import DEFAULT_CACHE_DIR, DEFAULT_CACHE_SIZE, SampleCache
+from sdb_profile import profiled
+from sdb_core import (METHODS, METHOD_OPTIONS, SEPARATORS, SampleConfig, AggregateConfig,
+                      FeatureConfig, ModelConfig, PredictConfig, OutputConfig, SearchConfig, SDBPipeline,
+                      band_labels)
+
+
+JOB_DEFAULTS = {
+    'image': None,
+    'output': None,
+    'images': [],
+    'output_dir': None,
+    'suffix': '_sdb',
+    'samples': [],
+    'separator': 'Comma',
+    'header_line': 1,
+    'data_line': 1,
+    'chunk_size': None,
+    'x': None,
+    'y': None,
+    'sample_crs': None,
+    'extract': True,
+    'aggregate': None,
+    'stride': 1,
+    'depth': None,
+    'first_band': None,
+    'last_band': None,
+    'limit': -30,
+    'method': METHODS[0],
+    'options': None,
+    'search': None,
+    'train_percent': 75.0,
+    'cell_size': None,
+    'folds': 0,
+    'workers': -1,
+    'memory_budget': DEFAULT_MEMORY_BUDGET // 2**20,
+    'mask': None,
+    'water_ratio': None,
+    'model': None,
+    'save_model': None,
+    'model_compress': None,
+    'driver': 'GTiff',
+    'dtype': OutputConfig().dtype,
+    'nodata': None,
+    'scale': OutputConfig().scale,
+    'compress': OutputConfig().compress,
+    'overviews': True,
+    'report': True,
+    'cache': True,
+    'cache_dir': DEFAULT_CACHE_DIR,
+    'cache_size': DEFAULT_CACHE_SIZE // 2**20
+}
+
+def load_jobs(config_loc):
+    """ Read the list of jobs stored in a JSON config file """
+
+    with open(config_loc) as config_file:
+        config = json.load(config_file)
+
+    if isinstance(config, dict):
+        config = config.get('jobs', [config])
+
+    return config
+
+
+def method_options(method, options):
+    """ Typed method options from a JSON list (dialog order) or object """
+
+    if options is None:
+        return METHOD_OPTIONS[method]()
+    elif isinstance(options, dict):
+        return METHOD_OPTIONS[method](**options)
+    else:
+        return METHOD_OPTIONS[method](*options)
+
+
+def predict_config(job):
+
+    return PredictConfig(
+        job['memory_budget'] * 2**20,
+        job['workers'],
+        job['mask'],
+        tuple(job['water_ratio']) if job['water_ratio'] else None
+    )
+
+
+def job_scenes(job):
+    """ (image, output) pairs of the images globs of job, sorted and without duplicates """
+
+    images = []
+    for pattern in job['images']:
+        for image in sorted(glob.glob(pattern, recursive=True)) or [pattern]:
+            if image not in images:
+                images.append(image)
+
+    stem, extension = os.path.splitext(job['output'] or '')
+    if extension == '.gz':
+        extension = os.path.splitext(stem)[1] + extension
+    extension = extension or '.tif'
+
+    return [
+        (image, os.path.join(job['output_dir'],
+                             os.path.splitext(os.path.basename(image))[0] + job['suffix'] + extension))
+        for image in images
+    ]
+
+
+def output_config(job):
+
+    return OutputConfig(
+        job['dtype'],
+        job['nodata'],
+        job['scale'],
+        job['compress'],
+        job['overviews']
+    )
+
+
+def fit_predict(pipeline, job, log=print):
+    """ Load the samples of job, fit the model and predict the loaded image """
+
+    samples_raw = pipeline.load_samples(SampleConfig(
+        tuple(job['samples']),
+        SEPARATORS[job['separator']],
+        job['header_line'] - 1,
+        job['data_line'] - 1,
+        job['chunk_size']
+    ), n_workers=job['workers'])
+
+    columns = list(samples_raw.columns)
+    bands = columns[1:]
+
+    if job['aggregate']:
+        samples_raw = pipeline.aggregate(AggregateConfig(
+            job['x'],
+            job['y'],
+            job['depth'] or columns[0],
+            job['sample_crs'],
+            job['aggregate'],
+            job['stride']
+        ))
+
+    if job['x'] and job['extract']:
+        pipeline.extract_features(FeatureConfig(
+            job['x'],
+            job['y'],
+            job['sample_crs']
+        ))
+        bands = band_labels(pipeline.image_raw)
+
+    model_config = ModelConfig(
+        job['depth'] or columns[0],
+        job['first_band'] or bands[0],
+        job['last_band'] or bands[-1],
+        job['method'],
+        method_options(job['method'], job['options']),
+        job['train_percent'],
+        job['limit'],
+        job['x'],
+        job['y'],
+        job['cell_size'],
+        job['folds']
+    )
+
+    if job['search']:
+        pipeline.split(model_config)
+        leaderboard, best = pipeline.tune(SearchConfig(**job['search']), n_jobs=job['workers'])
+        log(leaderboard.head(10).to_string())
+
+        model_config = model_config._replace(options=best)
+
+    pipeline.run(model_config, predict_config(job))
+
+
+def run_job(job, log=print):
+    """ Run load, split, fit, predict, save and report for one job
+
+    Returns the runtime of every stage.
+    """
+
+    job = dict(JOB_DEFAULTS, **job)
+
+    scenes = job_scenes(job)
+    if job['images'] and not job['output_dir']:
+        raise ValueError('images need an output_dir')
+
+    if job['image']:
+        log(job['image'] + ' -> ' + str(job['output']))
+    elif not (job['model'] and scenes):
+        raise ValueError('an image is needed to fit a model')
+
+    if scenes:
+        log(str(len(scenes)) + ' images -> ' + job['output_dir'])
+        os.makedirs(job['output_dir'], exist_ok=True)
+
+    sample_cache = None
+    if job['cache']:
+        sample_cache = SampleCache(job['cache_dir'], job['cache_size'] * 2**20)
+
+    pipeline = SDBPipeline(sample_cache)
+
+    try:
+        if job['image']:
+            pipeline.load_image(job['image'])
+
+        if job['model']:
+            # predict only, the samples are not needed
+            pipeline.load_model(job['model'])
+
+            if job['image']:
+                pipeline.run_model(predict_config(job))
+        else:
+            fit_predict(pipeline, job, log)
+
+        if job['image'] and job['output']:
+            pipeline.save(job['output'], job['driver'], job['report'], output_config(job))
+
+        if job['save_model']:
+            pipeline.save_model(job['save_model'], job['model_compress'])
+
+        if scenes:
+            pipeline.predict_scenes(scenes, predict_config(job), job['driver'],
+                                    output_config=output_config(job))
+            log(pipeline.scenes_info())
+
+            if job['report']:
+                pipeline.write_profile(os.path.join(job['output_dir'], 'scenes'))
+    finally:
+        pipeline.close()
+
+    for name, runtime in pipeline.timings.items():
+        log('  ' + name + ':\t' + str(runtime) + pipeline.print_profile(name))
+
+    return pipeline.timings
+
+
+def parse_args(argv=None):
+
+    parser = argparse.ArgumentParser(description='Satellite Derived Bathymetry batch runner')
+    parser.add_argument('config', nargs='*', help='JSON job config file(s)')
+    parser.add_argument('--image', help='image to predict')
+    parser.add_argument('--samples', nargs='+', default=[], help='sample text file(s)')
+    parser.add_argument('--output', help='prediction output location')
+    parser.add_argument('--images', nargs='+', default=[],
+                        help='more images or glob patterns predicted with the same model')
+    parser.add_argument('--output-dir', help='folder of the --images predictions')
+    parser.add_argument('--suffix', default='_sdb', help='appended to the --images file names')
+    parser.add_argument('--separator', choices=list(SEPARATORS), default='Comma')
+    parser.add_argument('--header-line', type=int, default=1)
+    parser.add_argument('--data-line', type=int, default=1)
+    parser.add_argument('--chunk-size', type=int,
+                        help='stream the samples from disk in chunks of this many rows '
+                             '(needs a method supporting partial_fit)')
+    parser.add_argument('--x', help='x/longitude column header, reads the band values from the image')
+    parser.add_argument('--y', help='y/latitude column header')
+    parser.add_argument('--sample-crs', help='CRS of the sample coordinates, e.g. EPSG:4326')
+    parser.add_argument('--no-extract', action='store_true',
+                        help='keep the band columns of the samples, x/y only locate them')
+    parser.add_argument('--aggregate', choices=['median', 'mean'],
+                        help='combine the soundings of every image pixel (needs --x/--y)')
+    parser.add_argument('--stride', type=int, default=1,
+                        help='keep only every n-th pixel row and column when aggregating')
+    parser.add_argument('--depth', help='depth column header')
+    parser.add_argument('--first-band', help='first band column header')
+    parser.add_argument('--last-band', help='last band column header')
+    parser.add_argument('--limit', type=float, default=JOB_DEFAULTS['limit'])
+    parser.add_argument('--no-limit', action='store_true', help='disable depth limitation')
+    parser.add_argument('--method', choices=METHODS, default=METHODS[0])
+    parser.add_argument('--options', type=json.loads,
+                        help='method options as a JSON list (dialog order) or object')
+    parser.add_argument('--search', type=json.loads,
+                        help='tune the method options first, JSON object like '
+                             '{"space": {"n_estimators": [100, 300]}, "strategy": "halving"}')
+    parser.add_argument('--train-percent', type=float, default=75.0)
+    parser.add_argument('--cell-size', type=float,
+                        help='split whole grid cells of this size (x/y units) instead of rows, '
+                             '--train-percent is then the share of cells')
+    parser.add_argument('--folds', type=int, default=0,
+                        help='spatial k-fold cross validation over the cells')
+    parser.add_argument('--workers', type=int, default=-1)
+    parser.add_argument('--memory-budget', type=int, default=JOB_DEFAULTS['memory_budget'],
+                        help='MB of band data read per block')
+    parser.add_argument('--mask', help='land/cloud mask raster, nonzero pixels are skipped')
+    parser.add_argument('--water-ratio', nargs=3, type=float,
+                        metavar=('FIRST', 'SECOND', 'THRESHOLD'))
+    parser.add_argument('--model', help='predict with a saved model, no samples needed')
+    parser.add_argument('--save-model', help='store the fitted model for later --model runs')
+    parser.add_argument('--model-compress', type=int, choices=range(10),
+                        help='zlib level of the saved model, 0 is memory mapped when loaded '
+                             '(default 0 for Random Forest, 3 otherwise)')
+    parser.add_argument('--driver', default='GTiff', help='GDAL driver of the output, e.g. COG')
+    parser.add_argument('--dtype', choices=DEPTH_TYPES, default=JOB_DEFAULTS['dtype'],
+                        help='output depth type, int16 stores depth / --scale')
+    parser.add_argument('--nodata', type=float, help='written in place of NaN')
+    parser.add_argument('--scale', type=float, default=JOB_DEFAULTS['scale'],
+                        help='metres per int16 step')
+    parser.add_argument('--compress', choices=COMPRESSIONS, default=JOB_DEFAULTS['compress'])
+    parser.add_argument('--no-overviews', action='store_true')
+    parser.add_argument('--no-report', action='store_true',
+                        help='skip the text, JSON and stage CSV reports')
+    parser.add_argument('--cprofile', help='write cProfile stats of all jobs to this file')
+    parser.add_argument('--py-spy', help='record a py-spy flame graph of all jobs to this SVG')
+    parser.add_argument('--no-cache', action='store_true', help='always parse the sample files')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='parsed sample cache location')
+    parser.add_argument('--cache-size', type=int, default=JOB_DEFAULTS['cache_size'],
+                        help='MB of parsed samples kept in the cache')
+
+    return parser, parser.parse_args(argv)
+
+
+def main(argv=None):
+
+    parser, args = parse_args(argv)
+
+    jobs = []
+    for config_loc in args.config:
+        jobs.extend(load_jobs(config_loc))
+
+    if args.image or args.images:
+        water_ratio = None
+        if args.water_ratio:
+            water_ratio = [int(args.water_ratio[0]), int(args.water_ratio[1]), args.water_ratio[2]]
+
+        jobs.append({
+            'image': args.image,
+            'samples': args.samples,
+            'output': args.output,
+            'images': args.images,
+            'output_dir': args.output_dir,
+            'suffix': args.suffix,
+            'separator': args.separator,
+            'header_line': args.header_line,
+            'data_line': args.data_line,
+            'chunk_size': args.chunk_size,
+            'x': args.x,
+            'y': args.y,
+            'sample_crs': args.sample_crs,
+            'extract': not args.no_extract,
+            'aggregate': args.aggregate,
+            'stride': args.stride,
+            'depth': args.depth,
+            'first_band': args.first_band,
+            'last_band': args.last_band,
+            'limit': None if args.no_limit else args.limit,
+            'method': args.method,
+            'options': args.options,
+            'search': args.search,
+            'train_percent': args.train_percent,
+            'cell_size': args.cell_size,
+            'folds': args.folds,
+            'workers': args.workers,
+            'memory_budget': args.memory_budget,
+            'mask': args.mask,
+            'water_ratio': water_ratio,
+            'model': args.model,
+            'save_model': args.save_model,
+            'model_compress': args.model_compress,
+            'driver': args.driver,
+            'dtype': args.dtype,
+            'nodata': args.nodata,
+            'scale': args.scale,
+            'compress': args.compress,
+            'overviews': not args.no_overviews,
+            'report': not args.no_report,
+            'cache': not args.no_cache,
+            'cache_dir': args.cache_dir,
+            'cache_size': args.cache_size
+        })
+
+    if not jobs:
+        parser.error('no jobs given, pass a config file, --image/--samples/--output '
+                          'or --model/--images/--output-dir')
+
+    failed = 0
+    time_start = datetime.datetime.now()
+
+    with profiled(args.cprofile, args.py_spy):
+        for job in jobs:
+            try:
+                run_job(job)
+            except Exception as e:
+                failed += 1
+                print('  failed: ' + repr(e), file=sys.stderr)
+
+    print(str(len(jobs) - failed) + ' of ' + str(len(jobs)) + ' jobs done in ' +
+          str(datetime.datetime.now() - time_start))
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,157 @@
+import numpy as np
+import pandas as pd
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+
+
+# bytes of parsed samples kept on disk before the least recently used are evicted
+DEFAULT_CACHE_SIZE = 2 * 2**30
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    'SDB_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.sdb_cache', 'samples'))
+
+# bump when the entry layout or the parsing rules change
+CACHE_VERSION = 1
+
+
+def file_fingerprint(file):
+    """ Absolute path, size and modification time identifying a file version """
+
+    stat = os.stat(file)
+
+    return os.path.abspath(file), stat.st_size, stat.st_mtime_ns
+
+
+def dir_nbytes(path):
+
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+class SampleCache(object):
+    """ Parsed sample tables stored column by column as .npy files
+
+    One entry per source file and parse settings, keyed by the file path,
+    size, mtime, separator, header/data lines and column dtypes, so a
+    changed file or setting is simply a miss. Numeric columns are memory
+    mapped on a hit; other columns are pickled. Entries beyond max_size
+    bytes are evicted least recently used first.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_size=DEFAULT_CACHE_SIZE):
+
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.lock = threading.Lock()
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+
+    def key(self, file, sep, header, skiprows, dtype):
+
+        dtype = sorted((str(column), np.dtype(d).str) for column, d in (dtype or {}).items())
+        fingerprint = (CACHE_VERSION, file_fingerprint(file), sep, header, list(skiprows or []), dtype)
+
+        return hashlib.sha1(json.dumps(fingerprint).encode('utf-8')).hexdigest()
+
+
+    def get(self, key):
+        """ The cached table of key, None on a miss """
+
+        entry = os.path.join(self.cache_dir, key)
+
+        try:
+            with open(os.path.join(entry, 'columns.json')) as meta_file:
+                meta = json.load(meta_file)
+
+            with open(os.path.join(entry, 'objects.pkl'), 'rb') as objects_file:
+                objects = pickle.load(objects_file)
+
+            columns = {}
+            for i, (column, kind) in enumerate(meta['columns']):
+                if kind == 'npy':
+                    columns[i] = np.load(os.path.join(entry, str(i) + '.npy'), mmap_mode='r')
+                else:
+                    columns[i] = objects[i]
+
+            # mark as recently used
+            os.utime(os.path.join(entry, 'columns.json'))
+        except (OSError, ValueError, EOFError, KeyError, pickle.UnpicklingError):
+            return None
+
+        samples = pd.DataFrame(columns, copy=False)
+        samples.columns = pd.Index([column for column, _ in meta['columns']])
+
+        return samples
+
+
+    def put(self, key, samples):
+        """ Store a parsed table under key, replacing any previous entry """
+
+        entry = os.path.join(self.cache_dir, key)
+        staging = tempfile.mkdtemp(prefix='.' + key, dir=self.cache_dir)
+
+        try:
+            meta = []
+            objects = {}
+
+            for i, column in enumerate(samples.columns):
+                values = samples.iloc[:, i]
+
+                if values.dtype.kind in 'biuf':
+                    np.save(os.path.join(staging, str(i) + '.npy'), values.to_numpy())
+                    meta.append((column, 'npy'))
+                else:
+                    objects[i] = values.to_numpy(dtype=object)
+                    meta.append((column, 'pkl'))
+
+            with open(os.path.join(staging, 'objects.pkl'), 'wb') as objects_file:
+                pickle.dump(objects, objects_file, pickle.HIGHEST_PROTOCOL)
+
+            # written last, an entry without it is never read
+            with open(os.path.join(staging, 'columns.json'), 'w') as meta_file:
+                json.dump({'columns': meta}, meta_file)
+
+            with self.lock:
+                shutil.rmtree(entry, ignore_errors=True)
+                os.replace(staging, entry)
+        except (OSError, TypeError, ValueError):
+            # an uncacheable table (e.g. non string headers) is only read slower next time
+            shutil.rmtree(staging, ignore_errors=True)
+
+
+    def evict(self):
+        """ Remove the least recently used entries until the cache fits max_size """
+
+        with self.lock:
+            entries = []
+            for entry in os.scandir(self.cache_dir):
+                if not entry.is_dir() or entry.name.startswith('.'):
+                    continue
+
+                try:
+                    used = os.stat(os.path.join(entry.path, 'columns.json')).st_mtime
+                except OSError:
+                    used = 0
+
+                entries.append((used, dir_nbytes(entry.path), entry.path))
+
+            size = sum(nbytes for _, nbytes, _ in entries)
+
+            for used, nbytes, path in sorted(entries):
+                if size <= self.max_size:
+                    break
+
+                shutil.rmtree(path, ignore_errors=True)
+                size -= nbytes
+
+
+    def clear(self):
+
+        with self.lock:
+            for entry in os.scandir(self.cache_dir):
+                shutil.rmtree(entry.path, ignore_errors=True)
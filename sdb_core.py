@@ -0,0 +1,1962 @@
+from sklearn import metrics
+from sklearn.linear_model import LinearRegression
+from sklearn.ensemble import HistGradientBoostingRegressor, RandomForestRegressor
+from sklearn.svm import SVR
+from sklearn.kernel_approximation import Nystroem, RBFSampler
+from sklearn.model_selection import GroupKFold, GroupShuffleSplit, KFold, train_test_split
+from sklearn.base import clone
+from joblib import Parallel, delayed, parallel_backend
+from threadpoolctl import threadpool_limits
+import joblib
+import pandas as pd
+import numpy as np
+import rasterio as rio
+from sdb_cache import file_fingerprint
+from sdb_profile import StageClock, machine_info, peak_rss
+from sdb_stream import (IncrementalLinearRegression, KernelApproximationRegression,
+                        StreamingScores, stream_chunks)
+from sdb_raster import (DEFAULT_MEMORY_BUDGET, DEFAULT_NODATA, POINT_DRIVERS, create_prediction,
+                        point_rowcol, predict_blocks, predict_scenes, resolve_workers,
+                        sample_pixels, write_output)
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+import sys, os
+import copy
+import datetime
+import itertools
+import json
+import math
+import pickle
+import re
+import tempfile
+import time
+import threading
+import warnings
+
+
+def resource_path(relative_path):
+    """ Get the absolute path to the resource, works for dev and for PyInstaller """
+    try:
+        # PyInstaller creates a temp folder and stores path in _MEIPASS
+        base_path = sys._MEIPASS
+    except Exception:
+        base_path = os.path.abspath(".")
+    return os.path.join(base_path, relative_path)
+
+
+####### Default Values #######
+METHODS = [
+    'Multiple Linear Regression',
+    'Random Forest',
+    'Support Vector Machines',
+    'Incremental Linear Regression',
+    'Support Vector Machines (approximate)',
+    'Histogram Gradient Boosting'
+]
+
+
+class MLROptions(NamedTuple):
+    fit_intercept: bool = True
+    normalize: bool = False
+    copy_X: bool = True
+
+
+class RFOptions(NamedTuple):
+    n_estimators: int = 300
+    criterion: str = 'mse'
+    max_depth: Optional[int] = None # unlimited
+    min_samples_leaf: int = 1
+    max_features: float = 1.0 # share of the bands tried at each split
+    max_samples: Optional[float] = None # share of the training samples drawn per tree, all when None
+
+
+class SVMOptions(NamedTuple):
+    kernel: str = 'rbf'
+    gamma: float = .1
+    C: float = 1000.0
+
+
+class IncrementalLROptions(NamedTuple):
+    fit_intercept: bool = True
+
+
+class ApproxSVMOptions(NamedTuple):
+    kernel: str = 'rbf'
+    gamma: float = .1
+    C: float = 1000.0
+    n_components: int = 1000 # size of the approximate kernel feature space
+    approximation: str = 'fourier' # 'fourier' (random Fourier features, rbf only) or 'nystroem'
+
+
+class HGBOptions(NamedTuple):
+    learning_rate: float = .1
+    max_iter: int = 300 # boosting rounds, fewer when early stopping kicks in
+    max_leaf_nodes: int = 31
+    early_stopping: bool = True # stop once 10% held out training samples stop improving
+
+
+METHOD_OPTIONS = {
+    METHODS[0]: MLROptions,
+    METHODS[1]: RFOptions,
+    METHODS[2]: SVMOptions,
+    METHODS[3]: IncrementalLROptions,
+    METHODS[4]: ApproxSVMOptions,
+    METHODS[5]: HGBOptions
+}
+
+SEPARATORS = {'Tab': '\t', 'Comma': ',', 'Space': ' ', 'Semicolon': ';'}
+
+# numeric sample columns are parsed as float32, except coordinates needing the precision
+X_HEADERS = ('x', 'lon', 'long', 'longitude', 'easting')
+Y_HEADERS = ('y', 'lat', 'latitude', 'northing')
+COORDINATE_HEADERS = X_HEADERS + Y_HEADERS
+
+# header words marking a coordinate column, e.g. 'E', 'X_UTM', 'Easting_m', 'Lat_deg'
+COORDINATE_WORDS = COORDINATE_HEADERS + ('e', 'n', 'east', 'north', 'lng', 'utm', 'coord')
+
+# float32 steps are 1/128 or coarser beyond this, too coarse for any projected coordinate
+FLOAT32_MAX_ABS = 1e5
+
+# bump when the saved model artifact layout changes
+MODEL_VERSION = 1
+
+# fitted models kept per pipeline for refits with an unchanged configuration,
+# older ones beyond MODEL_CACHE_BYTES of pickled size are dropped too
+MODEL_CACHE_SIZE = 4
+MODEL_CACHE_BYTES = 2**30
+
+# random forest trees grown between two cancellation points
+FOREST_BATCH = 10
+
+FORMATS = {
+    'GeoTIFF (*.tif)': 'GTiff',
+    'Cloud Optimized GeoTIFF (*.tif)': 'COG',
+    'Erdas Imagine image (*.img)': 'HFA',
+    'XYZ Points (*.xyz)': 'XYZ',
+    'Gzipped XYZ Points (*.xyz.gz)': 'XYZ',
+    'CSV Points (*.csv)': 'CSV'
+}
+####### Default Values #######
+
+
+class SampleConfig(NamedTuple):
+    """ Which sample text files to read and how to parse them """
+
+    files: tuple
+    sep: str = ','
+    header: int = 0 # zero based header line
+    data_start: int = 0 # data rows skipped after the header
+    chunk_size: Optional[int] = None # rows per chunk to stream from disk, None loads all
+
+
+class FeatureConfig(NamedTuple):
+    """ Sample coordinate columns the band values are read from the image at """
+
+    x_label: str
+    y_label: str
+    crs: Optional[str] = None # CRS of the coordinates, None for the image CRS
+
+
+class AggregateConfig(NamedTuple):
+    """ How soundings falling into the same image pixel are combined """
+
+    x_label: str
+    y_label: str
+    depth_label: str
+    crs: Optional[str] = None # CRS of the coordinates, None for the image CRS
+    statistic: str = 'median' # or 'mean'
+    stride: int = 1 # keep only every stride-th pixel row and column
+
+
+class ModelConfig(NamedTuple):
+    """ Sample columns, depth limit, train/test split and regression method """
+
+    depth_label: str
+    start_label: str
+    end_label: str
+    method: str = METHODS[0]
+    options: tuple = MLROptions()
+    train_percent: float = 75.0
+    limit: Optional[float] = -30 # None disables the depth limitation
+    x_label: Optional[str] = None
+    y_label: Optional[str] = None
+    cell_size: Optional[float] = None # spatial block split in x/y units, None splits rows
+    folds: int = 0 # spatial k-fold cross validation over the cells, 0 skips it
+
+
+class PredictConfig(NamedTuple):
+    """ How the image is read and which pixels are predicted """
+
+    memory_budget: int = DEFAULT_MEMORY_BUDGET
+    n_workers: int = -1
+    mask_loc: Optional[str] = None
+    water_ratio: Optional[tuple] = None # (first band, second band, threshold)
+
+
+class OutputConfig(NamedTuple):
+    """ How the saved prediction is encoded """
+
+    dtype: str = 'float32' # one of DEPTH_TYPES, int16 is scaled by scale
+    nodata: Optional[float] = None # replaces NaN, None uses DEFAULT_NODATA of dtype
+    scale: float = 0.01 # metres per int16 step
+    compress: str = 'DEFLATE' # one of COMPRESSIONS, GeoTIFF and COG only
+    overviews: bool = True
+    blocksize: int = 512
+
+
+class SearchConfig(NamedTuple):
+    """ Option values tried by SDBPipeline.tune and how the space is searched """
+
+    space: dict # option name -> list of values, other options keep the model config value
+    strategy: str = 'grid' # 'grid', 'random' or 'halving'
+    n_iter: int = 10 # option sets drawn by the random search
+    folds: int = 3
+
+
+class Cancelled(Exception):
+    """ Raised inside a pipeline stage after SDBPipeline.cancel was called """
+
+
+def coordinate_like(column):
+    """ Whether a header names a coordinate, matching any of its words """
+
+    words = re.split(r'[^a-z]+', str(column).strip().lower())
+
+    return any(word in COORDINATE_WORDS for word in words)
+
+
+def sample_dtypes(file, sep=',', header=0, skiprows=None):
+    """ Column dtypes for read_csv, guessed from the first rows of file
+
+    Numeric columns become float32, except coordinate-like headers and
+    values too large for float32 to keep sub-decimetre steps.
+    """
+
+    head = pd.read_csv(file, sep=sep, header=header, skiprows=skiprows, nrows=100)
+
+    return {
+        column: np.float32 for column, dtype in head.dtypes.items()
+        if dtype.kind in 'iuf' and not coordinate_like(column) and
+        not (head[column].abs() >= FLOAT32_MAX_ABS).any()
+    }
+
+
+def parse_sample_file(file, sep=',', header=0, skiprows=None, dtype=None):
+
+    try:
+        return pd.read_csv(file, sep=sep, header=header, skiprows=skiprows, dtype=dtype)
+    except ValueError:
+        # a column numeric in the first file holds text in this one
+        return pd.read_csv(file, sep=sep, header=header, skiprows=skiprows)
+
+
+def read_sample_file(file, sep=',', header=0, skiprows=None, dtype=None, cache=None):
+    """ Parse one sample file, going through cache when one is given """
+
+    if cache is None:
+        return parse_sample_file(file, sep, header, skiprows, dtype)
+
+    key = cache.key(file, sep, header, skiprows, dtype)
+    samples = cache.get(key)
+
+    if samples is None:
+        samples = parse_sample_file(file, sep, header, skiprows, dtype)
+        cache.put(key, samples)
+
+    return samples
+
+
+def read_samples(files, sep=',', header=0, data_start=0, progress=None, n_workers=-1,
+                 cache=None):
+    """ Read and concatenate sample text files, returns the table and the files size
+
+    Files are parsed by a thread pool. data_start rows right after the
+    header line are skipped. Unchanged files are taken from the optional
+    SampleCache instead of being parsed again.
+    """
+
+    skiprows = list(range(header + 1, header + 1 + data_start))
+    dtype = sample_dtypes(files[0], sep, header, skiprows) if files else None
+
+    dummy = [None] * len(files)
+    sample_size = sum(os.path.getsize(file) for file in files)
+
+    with ThreadPoolExecutor(min(resolve_workers(n_workers), max(len(files), 1))) as executor:
+        futures = {
+            executor.submit(read_sample_file, file, sep, header, skiprows, dtype, cache): i
+            for i, file in enumerate(files)
+        }
+
+        try:
+            for done, future in enumerate(as_completed(futures)):
+                dummy[futures[future]] = future.result()
+
+                if progress is not None:
+                    progress(done + 1, len(files))
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    if cache is not None:
+        cache.evict()
+
+    samples_raw = pd.concat(dummy, ignore_index=True, sort=False)
+
+    return samples_raw, sample_size
+
+
+def iter_sample_chunks(files, sep=',', header=0, data_start=0, chunk_size=100000, progress=None):
+    """ Yield the samples of all files in DataFrames of at most chunk_size rows """
+
+    skiprows = list(range(header + 1, header + 1 + data_start))
+    dtype = sample_dtypes(files[0], sep, header, skiprows) if files else None
+
+    for i, file in enumerate(files):
+        with pd.read_csv(file, sep=sep, header=header, skiprows=skiprows, dtype=dtype,
+                         chunksize=chunk_size) as reader:
+            for chunk in reader:
+                yield chunk
+
+        if progress is not None:
+            progress(i + 1, len(files))
+
+
+def band_labels(dataset):
+
+    return ['Band ' + str(band) for band in range(1, dataset.count + 1)]
+
+
+def extract_features(samples, dataset, x_label, y_label, crs=None, progress=None):
+    """ Samples with the band values of the image pixel under each point appended
+
+    Points outside the image or on nodata pixels are dropped. Only the
+    image blocks holding points are read.
+    """
+
+    rows, cols = point_rowcol(dataset, samples[x_label], samples[y_label], crs)
+    features, valid = sample_pixels(dataset, rows, cols, progress)
+
+    samples = samples[valid]
+    bands = pd.DataFrame(features[valid], columns=band_labels(dataset), index=samples.index)
+
+    return pd.concat([samples, bands], axis=1).reset_index(drop=True)
+
+
+def group_reduce(values, starts, counts, statistic='median'):
+    """ Median or mean of consecutive groups of values starting at starts """
+
+    if statistic == 'mean':
+        return np.add.reduceat(values, starts) / counts
+
+    if statistic != 'median':
+        raise ValueError('Unknown aggregation statistic: ' + str(statistic))
+
+    # sort inside every group, then average the one or two middle values
+    group = np.repeat(np.arange(len(starts)), counts)
+    values = values[np.lexsort((values, group))]
+
+    return (values[starts + (counts - 1) // 2] + values[starts + counts // 2]) / 2
+
+
+def aggregate_samples(samples, dataset, x_label, y_label, depth_label, crs=None,
+                      statistic='median', stride=1):
+    """ One sample per image pixel holding soundings, with their median or mean depth
+
+    Numeric columns other than the coordinates are reduced with statistic,
+    the remaining columns and the coordinates come from the first sounding
+    of the pixel, and a Count column holds the number of soundings. With a
+    stride above one only every stride-th pixel row and column is kept.
+    Soundings outside the image or without a depth are dropped.
+    """
+
+    rows, cols = point_rowcol(dataset, samples[x_label], samples[y_label], crs)
+
+    keep = (rows >= 0) & (rows < dataset.height) & (cols >= 0) & (cols < dataset.width)
+    keep &= samples[depth_label].notna().to_numpy()
+
+    if stride > 1:
+        keep &= (rows % stride == 0) & (cols % stride == 0)
+
+    index = np.flatnonzero(keep)
+    pixel = rows[index] * dataset.width + cols[index]
+
+    order = np.argsort(pixel, kind='stable')
+    index, pixel = index[order], pixel[order]
+
+    starts = np.flatnonzero(np.r_[True, pixel[1:] != pixel[:-1]]) if pixel.size else pixel
+    counts = np.diff(np.r_[starts, pixel.size])
+
+    aggregated = samples.iloc[index[starts]].reset_index(drop=True)
+
+    for column in samples.columns:
+        if column in (x_label, y_label) or samples[column].dtype.kind not in 'iuf':
+            continue
+
+        values = samples[column].to_numpy()[index]
+        aggregated[column] = group_reduce(values, starts, counts, statistic).astype(
+            values.dtype if values.dtype.kind == 'f' else 'float64')
+
+    aggregated['Count'] = counts
+
+    return aggregated
+
+
+def depth_flipped(samples_raw, depth_label):
+    """ Whether most depths are positive, so the sign has to be flipped """
+
+    z = samples_raw[depth_label].to_numpy(dtype='float64')
+
+    return bool(np.count_nonzero(z > 0) > np.count_nonzero(~np.isnan(z)) / 2)
+
+
+def filter_samples(samples_raw, depth_label, start_label, end_label, limit=None):
+    """ Band values and negative depths of the usable samples, in one pass
+
+    Only the depth column and the band columns start_label to end_label
+    are read. A single mask drops missing depths and, when limit is
+    given, depths outside [limit, 0]; the bands of the kept rows are
+    gathered column by column into a float32 array, so the sample table
+    is never copied.
+
+    Returns (features, z, rows, flipped), rows being the positions of the
+    kept samples in samples_raw.
+    """
+
+    z = samples_raw[depth_label].to_numpy(dtype='float64')
+    known = ~np.isnan(z)
+
+    flipped = bool(np.count_nonzero(z > 0) > np.count_nonzero(known) / 2)
+    if flipped:
+        z = -z
+
+    keep = known
+    if limit is not None:
+        keep &= (z >= limit) & (z <= 0)
+
+    rows = np.flatnonzero(keep)
+
+    start_loc = samples_raw.columns.get_loc(start_label)
+    end_loc = samples_raw.columns.get_loc(end_label)
+
+    features = np.empty((len(rows), end_loc - start_loc + 1), dtype='float32')
+    for j in range(features.shape[1]):
+        features[:, j] = samples_raw.iloc[:, start_loc + j].to_numpy()[rows]
+
+    return features, z[rows], rows, flipped
+
+
+def sample_cells(samples, x_label, y_label, cell_size, rows=None):
+    """ Index of the square grid cell of side cell_size holding each sample, from 0
+
+    With rows, only the samples at these positions are placed.
+    """
+
+    xs = samples[x_label].to_numpy(dtype='float64')
+    ys = samples[y_label].to_numpy(dtype='float64')
+
+    if rows is not None:
+        xs, ys = xs[rows], ys[rows]
+
+    if not xs.size:
+        return np.zeros(0, dtype='int64')
+
+    col = np.floor((xs - xs.min()) / cell_size).astype('int64')
+    row = np.floor((ys - ys.min()) / cell_size).astype('int64')
+
+    return np.unique(row * (col.max() + 1) + col, return_inverse=True)[1]
+
+
+def split_samples(features, z, train_percent, cells=None):
+    """ Positions of the train and test samples among the filtered samples
+
+    With cells, whole grid cells go to either side and train_percent is
+    the share of cells used for training, so neighbouring soundings do
+    not leak into the test data.
+    """
+
+    test_data_size = (100 - train_percent) / 100
+
+    if cells is None:
+        return train_test_split(np.arange(len(z)), test_size=test_data_size, random_state=0)
+
+    splitter = GroupShuffleSplit(n_splits=1, test_size=test_data_size, random_state=0)
+
+    return next(splitter.split(features, z, cells))
+
+
+def build_regressor(method, options):
+    """ Create an unfitted regressor, returns it with a printable parameters summary """
+
+    if method == METHODS[0]:
+        regressor = LinearRegression(
+            fit_intercept=options.fit_intercept,
+            normalize=options.normalize,
+            copy_X=options.copy_X
+        )
+
+        print_parameters_info = (
+            'Fit Intercept:' + '\t\t' + str(options.fit_intercept) + '\n' +
+            'Normalize:' + '\t\t' + str(options.normalize) + '\n' +
+            'Copy X:' + '\t\t' + str(options.copy_X)
+        )
+    elif method == METHODS[1]:
+        # depth, leaf size and bootstrap share bound the size of every tree
+        regressor = RandomForestRegressor(
+            n_estimators=options.n_estimators,
+            criterion=options.criterion,
+            max_depth=options.max_depth,
+            min_samples_leaf=options.min_samples_leaf,
+            max_features=options.max_features,
+            max_samples=options.max_samples,
+            random_state=0)
+
+        print_parameters_info = (
+            'N Trees:' + '\t\t' + str(options.n_estimators) + '\n' +
+            'Criterion:' + '\t\t' + str(options.criterion) + '\n' +
+            'Max Depth:' + '\t\t' + str(options.max_depth) + '\n' +
+            'Min Samples Leaf:' + '\t' + str(options.min_samples_leaf) + '\n' +
+            'Max Features:' + '\t\t' + str(options.max_features) + '\n' +
+            'Max Samples:' + '\t\t' + str(options.max_samples)
+        )
+    elif method == METHODS[2]:
+        regressor = SVR(
+            kernel=options.kernel,
+            gamma=options.gamma,
+            C=options.C,
+            cache_size=8000)
+
+        print_parameters_info = (
+            'Kernel:' + '\t\t' + str(options.kernel) +'\n' +
+            'Gamma:' + '\t\t' + str(options.gamma) + '\n' +
+            'C:' + '\t\t' + str(options.C)
+        )
+    elif method == METHODS[3]:
+        regressor = IncrementalLinearRegression(fit_intercept=options.fit_intercept)
+
+        print_parameters_info = 'Fit Intercept:' + '\t\t' + str(options.fit_intercept)
+    elif method == METHODS[4]:
+        # the kernel is mapped onto n_components explicit features and solved linearly,
+        # ridge regularisation 1 / 2C corresponds to the SVR penalty C
+        if options.approximation == 'fourier':
+            if options.kernel != 'rbf':
+                raise ValueError('Random Fourier features only approximate the rbf kernel, '
+                                 'use the nystroem approximation for ' + str(options.kernel))
+
+            kernel_map = RBFSampler(gamma=options.gamma, n_components=options.n_components,
+                                    random_state=0)
+        elif options.approximation == 'nystroem':
+            kernel_map = Nystroem(kernel=options.kernel, gamma=options.gamma,
+                                  n_components=options.n_components, random_state=0)
+        else:
+            raise ValueError('Unknown kernel approximation: ' + str(options.approximation))
+
+        regressor = KernelApproximationRegression(kernel_map, alpha=1 / (2 * options.C))
+
+        print_parameters_info = (
+            'Kernel:' + '\t\t' + str(options.kernel) + '\n' +
+            'Gamma:' + '\t\t' + str(options.gamma) + '\n' +
+            'C:' + '\t\t' + str(options.C) + '\n' +
+            'Components:' + '\t\t' + str(options.n_components) + '\n' +
+            'Approximation:' + '\t\t' + str(options.approximation)
+        )
+    elif method == METHODS[5]:
+        # bands are binned into 255 bins once, trees are grown on the histograms
+        regressor = HistGradientBoostingRegressor(
+            learning_rate=options.learning_rate,
+            max_iter=options.max_iter,
+            max_leaf_nodes=options.max_leaf_nodes,
+            early_stopping=options.early_stopping,
+            random_state=0)
+
+        print_parameters_info = (
+            'Learning Rate:' + '\t\t' + str(options.learning_rate) + '\n' +
+            'Max Iterations:' + '\t\t' + str(options.max_iter) + '\n' +
+            'Max Leaf Nodes:' + '\t\t' + str(options.max_leaf_nodes) + '\n' +
+            'Early Stopping:' + '\t\t' + str(options.early_stopping)
+        )
+    else:
+        raise ValueError('Unknown regression method: ' + str(method))
+
+    return regressor, print_parameters_info
+
+
+def grow_forest(forest, n_estimators, features, z, progress=None, batch=FOREST_BATCH):
+    """ Grow forest up to n_estimators trees, batch trees per warm_start fit
+
+    progress(grown, n_estimators) is called after every batch, so it can
+    stop a long fit. With a fixed random_state the result equals a single
+    fit of n_estimators trees. forest may be unfitted.
+    """
+
+    grown = len(getattr(forest, 'estimators_', []))
+
+    while grown < n_estimators:
+        grown = min(grown + batch, n_estimators)
+        forest.set_params(n_estimators=grown, warm_start=True)
+        forest.fit(features, z)
+
+        if progress is not None:
+            progress(grown, n_estimators)
+
+    forest.set_params(n_estimators=n_estimators, warm_start=False)
+
+    return forest
+
+
+def resize_forest(forest, n_estimators, features, z, progress=None, batch=FOREST_BATCH):
+    """ A fitted random forest with n_estimators trees made from a fitted forest
+
+    Missing trees are grown with grow_forest on the same training data,
+    surplus trees are dropped. With a fixed random_state the result equals
+    fitting n_estimators trees from scratch. The trees of forest are
+    shared, forest itself is not changed.
+    """
+
+    resized = copy.copy(forest)
+    resized.estimators_ = list(forest.estimators_[:n_estimators])
+
+    return grow_forest(resized, n_estimators, features, z, progress, batch)
+
+
+class ByteCounter(object):
+    """ Write only file object counting the bytes written to it """
+
+    def __init__(self):
+
+        self.nbytes = 0
+
+
+    def write(self, data):
+
+        self.nbytes += memoryview(data).nbytes
+
+
+def model_size(regressor):
+    """ Pickled size of a regressor in bytes, without holding the pickle in memory """
+
+    counter = ByteCounter()
+    pickle.dump(regressor, counter, pickle.HIGHEST_PROTOCOL)
+
+    return counter.nbytes
+
+
+def estimate_size(regressor):
+    """ Approximate pickled size of a regressor in bytes
+
+    A forest is dominated by its tree nodes, 64 bytes each plus their
+    values, which is counted without pickling gigabytes. Other
+    regressors are small and are measured with model_size.
+    """
+
+    if isinstance(regressor, RandomForestRegressor):
+        return sum(tree.tree_.node_count * 64 + tree.tree_.value.nbytes
+                   for tree in regressor.estimators_)
+
+    return model_size(regressor)
+
+
+def validate(regressor, features_test, z_test):
+    """ RMSE, MAE and R\u00B2 of the regressor on the test data """
+
+    z_validate = regressor.predict(features_test)
+    rmse = np.sqrt(metrics.mean_squared_error(z_test, z_validate))
+    mae = metrics.mean_absolute_error(z_test, z_validate)
+    r2 = metrics.r2_score(z_test, z_validate)
+
+    return rmse, mae, r2
+
+
+def cross_validate(regressor, features, z, cells, folds, progress=None):
+    """ RMSE, MAE and R\u00B2 of every fold of a spatial k-fold over the cells
+
+    Returns a (folds, 3) array.
+    """
+
+    scores = []
+    splits = list(GroupKFold(n_splits=folds).split(features, z, cells))
+
+    for i, (train, test) in enumerate(splits):
+        fold_regressor = clone(regressor).fit(features[train], z[train])
+        scores.append(validate(fold_regressor, features[test], z[test]))
+
+        if progress is not None:
+            progress(i + 1, len(splits))
+
+    return np.array(scores)
+
+
+def search_candidates(options, search_config):
+    """ Option tuples of the search space, a random subset for the random search """
+
+    names = list(search_config.space)
+    candidates = [
+        options._replace(**dict(zip(names, values)))
+        for values in itertools.product(*(search_config.space[name] for name in names))
+    ]
+
+    if search_config.strategy == 'random' and search_config.n_iter < len(candidates):
+        chosen = np.random.default_rng(0).choice(len(candidates), search_config.n_iter, replace=False)
+        candidates = [candidates[i] for i in sorted(chosen)]
+    elif search_config.strategy not in ('grid', 'random', 'halving'):
+        raise ValueError('Unknown search strategy: ' + str(search_config.strategy))
+
+    return candidates
+
+
+def evaluate_options(method, options, features, z, train, test):
+    """ Fit one option set on train, returns (rmse, mae, r2, fit seconds) on test """
+
+    regressor = build_regressor(method, options)[0]
+
+    time_start = time.perf_counter()
+    regressor.fit(features[train], z[train])
+    fit_time = time.perf_counter() - time_start
+
+    return validate(regressor, features[test], z[test]) + (fit_time,)
+
+
+def cross_validate_options(method, candidates, features, z, cells, folds, n_jobs=-1, progress=None):
+    """ Mean fold scores of every candidate, every (candidate, fold) fit in a worker process
+
+    Folds are spatial over cells when given, shuffled rows otherwise.
+    Returns a (candidates, 4) array of RMSE, MAE, R\u00B2 and fit seconds.
+    """
+
+    if cells is not None:
+        splits = list(GroupKFold(n_splits=folds).split(features, z, cells))
+    else:
+        splits = list(KFold(n_splits=folds, shuffle=True, random_state=0).split(features, z))
+
+    tasks = [
+        delayed(evaluate_options)(method, options, features, z, train, test)
+        for options in candidates for train, test in splits
+    ]
+
+    results = []
+    parallel = Parallel(n_jobs=n_jobs, backend='loky', return_as='generator')
+
+    for result in parallel(tasks):
+        results.append(result)
+
+        if progress is not None:
+            progress(len(results), len(tasks))
+
+    return np.array(results).reshape(len(candidates), len(splits), 4).mean(axis=1)
+
+
+def search_options(method, options, search_config, features, z, cells=None, n_jobs=-1,
+                   progress=None):
+    """ Cross validate the option sets of search_config, returns a leaderboard best first
+
+    The halving strategy scores all candidates on a small share of the
+    samples and keeps the best third for three times as many samples
+    until one candidate is left or all samples are used.
+    """
+
+    candidates = search_candidates(options, search_config)
+    features = np.asarray(features)
+    z = np.asarray(z)
+
+    if search_config.strategy == 'halving':
+        rounds = max(math.ceil(math.log(len(candidates), 3)), 1) if len(candidates) > 1 else 0
+        order = np.random.default_rng(0).permutation(len(z))
+    else:
+        rounds = 0
+        order = np.arange(len(z))
+
+    board = {}
+    remaining = list(range(len(candidates)))
+
+    for r in range(rounds + 1):
+        n_samples = max(len(z) // 3 ** (rounds - r), min(len(z), 100 * search_config.folds))
+        subset = np.sort(order[:n_samples])
+
+        scores = cross_validate_options(
+            method, [candidates[i] for i in remaining], features[subset], z[subset],
+            None if cells is None else cells[subset], search_config.folds, n_jobs, progress)
+
+        for i, score in zip(remaining, scores):
+            board[i] = tuple(score) + (n_samples,)
+
+        if len(remaining) == 1 or n_samples == len(z):
+            break
+
+        ranked = [remaining[i] for i in np.argsort(scores[:, 0], kind='stable')]
+        remaining = ranked[:math.ceil(len(ranked) / 3)]
+
+    leaderboard = pd.DataFrame(
+        [candidates[i]._asdict() for i in board],
+        index=list(board)
+    )
+    leaderboard = leaderboard[list(search_config.space)]
+    leaderboard[['RMSE', 'MAE', 'R\u00B2', 'Fit Time (s)', 'Samples']] = [board[i] for i in board]
+    leaderboard['Samples'] = leaderboard['Samples'].astype('int64')
+
+    leaderboard = leaderboard.sort_values(['Samples', 'RMSE'], ascending=[False, True], kind='stable')
+    best = candidates[leaderboard.index[0]]
+
+    return leaderboard.reset_index(drop=True), best
+
+
+def pixel_size(image_raw):
+
+    coord1 = np.array(image_raw.transform * (0, 0))
+    coord2 = np.array(image_raw.transform * (1, 1))
+
+    return coord2 - coord1
+
+
+class SDBPipeline(object):
+    """ Load, fit, predict and save a satellite derived bathymetry run
+
+    Every stage keeps its results on the instance, so several pipelines
+    can run side by side. Stage runtimes are collected in timings and
+    their wall/CPU time, peak memory and throughput in profiles. A stage
+    running in another thread stops with Cancelled at its next block or
+    file once cancel is called.
+    """
+
+    def __init__(self, sample_cache=None, model_cache_size=MODEL_CACHE_SIZE,
+                 model_cache_bytes=MODEL_CACHE_BYTES):
+
+        self.img_loc = None
+        self.img_size = 0
+        self.image_raw = None
+
+        self.sample_cache = sample_cache
+        self.sample_config = None
+        self.sample_size = 0
+        self.samples_loaded = None
+        self.aggregate_config = None
+        self.samples_aggregated = None
+        self.feature_config = None
+        self.samples_raw = None
+        self.filtered = None
+
+        self.model_config = None
+        self.samples_split = None
+        self.split_key = None
+        self.split_cells = None
+        self.model_cache = OrderedDict()
+        self.model_cache_size = model_cache_size
+        self.model_cache_bytes = model_cache_bytes
+        self.fit_source = None
+        self.regressor = None
+        self.regressor_size = None
+        self.print_parameters_info = ''
+        self.depth_flipped = None
+        self.model_loc = None
+        self.model_artifact = None
+
+        self.predict_config = None
+        self.predict_loc = None
+        self.output_config = None
+        self.npredicted = 0
+        self.scores = None
+        self.cv_scores = None
+
+        self.search_config = None
+        self.leaderboard = None
+
+        self.scene_results = []
+
+        self.timings = OrderedDict()
+        self.profiles = OrderedDict()
+        self.clock = None
+        self.cancelled = threading.Event()
+
+
+    def cancel(self):
+
+        self.cancelled.set()
+
+
+    def check_cancelled(self):
+
+        if self.cancelled.is_set():
+            raise Cancelled()
+
+
+    def checked(self, progress):
+        """ Wrap a progress callback so every call is also a cancellation point """
+
+        clock = self.clock
+
+        def checked_progress(done, total):
+            self.check_cancelled()
+
+            if clock is not None:
+                clock.step()
+
+            if progress is not None:
+                progress(done, total)
+
+        return checked_progress
+
+
+    def start_stage(self):
+        """ Start the clocks of a stage, progress callbacks wrapped from now on count its steps """
+
+        self.clock = StageClock()
+
+        return self.clock
+
+
+    def stage(self, name, time_start, items=None, unit=None):
+        """ Record the runtime and profile of a stage started at time_start
+
+        items of unit (e.g. samples or pixels) processed give its throughput.
+        """
+
+        time_end = datetime.datetime.now()
+        self.timings[name] = time_end - time_start.started
+        self.profiles[name] = time_start.profile(name, items, unit)
+
+        return time_end
+
+
+    def load_image(self, img_loc):
+
+        self.check_cancelled()
+        time_start = self.start_stage()
+
+        if self.image_raw is not None:
+            self.image_raw.close()
+
+        self.img_loc = img_loc
+        self.img_size = os.path.getsize(img_loc)
+        self.image_raw = rio.open(img_loc)
+
+        self.stage('Image Load', time_start, self.image_raw.width * self.image_raw.height, 'pixels')
+
+        return self.image_raw
+
+
+    def load_samples(self, sample_config, progress=None, n_workers=-1):
+
+        self.check_cancelled()
+        time_start = self.start_stage()
+
+        if sample_config.chunk_size is not None:
+            # streamed samples are read while fitting, only keep a preview
+            chunks = iter_sample_chunks(list(sample_config.files), sample_config.sep,
+                                        sample_config.header, sample_config.data_start, 1000)
+            samples_raw = next(chunks)
+            chunks.close()
+            sample_size = sum(os.path.getsize(file) for file in sample_config.files)
+        else:
+            samples_raw, sample_size = read_samples(
+                list(sample_config.files),
+                sample_config.sep,
+                sample_config.header,
+                sample_config.data_start,
+                self.checked(progress),
+                n_workers,
+                self.sample_cache
+            )
+
+        self.sample_config = sample_config
+        self.samples_raw, self.sample_size = samples_raw, sample_size
+        self.samples_changed()
+        self.samples_loaded = samples_raw
+        self.aggregate_config = None
+        self.samples_aggregated = None
+        self.feature_config = None
+
+        # streamed samples are only counted while fitting
+        nsamples = None if self.streaming() else len(samples_raw)
+        self.stage('Sample Load', time_start, nsamples, 'samples')
+
+        return self.samples_raw
+
+
+    def streaming(self):
+
+        return self.sample_config is not None and self.sample_config.chunk_size is not None
+
+
+    def sample_chunks(self, progress=None):
+        """ Chunks of the streamed sample files, read again on every call """
+
+        return iter_sample_chunks(
+            list(self.sample_config.files),
+            self.sample_config.sep,
+            self.sample_config.header,
+            self.sample_config.data_start,
+            self.sample_config.chunk_size,
+            self.checked(progress)
+        )
+
+
+    def aggregate(self, aggregate_config):
+        """ Reduce the loaded samples to one sample per image pixel """
+
+        self.check_cancelled()
+
+        if self.streaming():
+            raise ValueError('Streamed samples can not be aggregated, load them into memory')
+        time_start = self.start_stage()
+
+        self.samples_aggregated = aggregate_samples(
+            self.samples_loaded,
+            self.image_raw,
+            aggregate_config.x_label,
+            aggregate_config.y_label,
+            aggregate_config.depth_label,
+            aggregate_config.crs,
+            aggregate_config.statistic,
+            aggregate_config.stride
+        )
+        self.samples_raw = self.samples_aggregated
+        self.samples_changed()
+        self.aggregate_config = aggregate_config
+        self.feature_config = None
+
+        self.stage('Aggregation', time_start, len(self.samples_loaded), 'samples')
+
+        return self.samples_raw
+
+
+    def extract_features(self, feature_config, progress=None):
+        """ Append the image band values at the sample coordinates to the samples
+
+        Starts from the aggregated samples when aggregate ran before.
+        """
+
+        self.check_cancelled()
+
+        if self.streaming():
+            raise ValueError('Band values can not be extracted for streamed samples, '
+                             'load them into memory')
+        time_start = self.start_stage()
+
+        if self.samples_aggregated is not None:
+            samples = self.samples_aggregated
+        else:
+            samples = self.samples_loaded
+
+        self.samples_raw = extract_features(
+            samples,
+            self.image_raw,
+            feature_config.x_label,
+            feature_config.y_label,
+            feature_config.crs,
+            self.checked(progress)
+        )
+        self.samples_changed()
+        self.feature_config = feature_config
+
+        self.stage('Feature Extraction', time_start, len(self.samples_raw), 'samples')
+
+        return self.samples_raw
+
+
+    def samples_changed(self):
+        """ Drop the filtered samples and split of the previous samples """
+
+        self.filtered = None
+        self.split_key = None
+
+
+    def split(self, model_config):
+
+        self.check_cancelled()
+        time_start = self.start_stage()
+
+        self.model_config = model_config
+        self.cv_scores = None
+
+        split_key = (model_config.depth_label, model_config.start_label, model_config.end_label,
+                     model_config.limit, model_config.train_percent, model_config.x_label,
+                     model_config.y_label, model_config.cell_size)
+
+        if not self.streaming() and split_key == self.split_key:
+            # same samples and split settings, e.g. only the method changed
+            self.stage('Split', time_start, len(self.samples_raw), 'samples')
+
+            return self.samples_split
+
+        self.split_cells = None
+        self.split_key = None
+
+        if self.streaming():
+            if model_config.cell_size is not None:
+                raise ValueError('Streamed samples only support the random split')
+
+            # every chunk is split while fitting and validating
+            self.depth_flipped = depth_flipped(self.samples_raw, model_config.depth_label)
+            self.samples_split = None
+            self.stage('Split', time_start)
+
+            return self.samples_split
+
+        features, z, rows, self.depth_flipped = self.filtered_samples()
+
+        cells = None
+        if model_config.cell_size is not None:
+            cells = sample_cells(self.samples_raw, model_config.x_label, model_config.y_label,
+                                 model_config.cell_size, rows)
+
+        train, test = split_samples(features, z, model_config.train_percent, cells)
+
+        self.samples_split = [features[train], features[test], z[train], z[test]]
+        self.split_key = split_key
+        if cells is not None:
+            self.split_cells = cells[train]
+
+        self.stage('Split', time_start, len(self.samples_raw), 'samples')
+
+        return self.samples_split
+
+
+    def filtered_samples(self):
+        """ filter_samples for the model config, cached until the samples change
+
+        Only the depth, band and limit settings are part of the key, so
+        refitting with another method or options reuses the arrays.
+        """
+
+        model_config = self.model_config
+        key = (model_config.depth_label, model_config.start_label, model_config.end_label,
+               model_config.limit)
+
+        if self.filtered is None or self.filtered[0] != key:
+            self.filtered = (key, filter_samples(self.samples_raw, *key))
+
+        return self.filtered[1]
+
+
+    def fit(self, n_jobs=-1, progress=None):
+
+        self.check_cancelled()
+        time_start = self.start_stage()
+
+        self.model_loc = None
+        self.model_artifact = None
+
+        fit_key = self.fit_key()
+
+        if fit_key in self.model_cache:
+            self.model_cache.move_to_end(fit_key)
+            self.regressor, self.print_parameters_info, _ = self.model_cache[fit_key]
+            self.fit_source = 'cached model'
+
+            self.stage('Fit', time_start, self.fit_samples(), 'samples')
+
+            return self.regressor
+
+        self.regressor, self.print_parameters_info = build_regressor(
+            self.model_config.method, self.model_config.options)
+        self.fit_source = None
+
+        if self.streaming():
+            if not hasattr(self.regressor, 'partial_fit'):
+                raise ValueError(self.model_config.method + ' can not learn from streamed '
+                                 'samples, use ' + METHODS[3])
+
+            for features_train, _, z_train, _ in self.stream_chunks(progress):
+                if len(z_train):
+                    self.regressor.partial_fit(features_train, z_train)
+        else:
+            forest = self.cached_forest(fit_key)
+            n_workers = resolve_workers(n_jobs)
+
+            # joblib drives the forest, OpenMP the gradient boosting
+            with parallel_backend('threading', n_jobs=n_jobs), \
+                    threadpool_limits(n_workers, user_api='openmp'):
+                if forest is not None:
+                    self.regressor = resize_forest(forest, self.model_config.options.n_estimators,
+                                                   self.samples_split[0], self.samples_split[2],
+                                                   self.checked(progress), max(FOREST_BATCH, n_workers))
+                    grown = len(forest.estimators_) < len(self.regressor.estimators_)
+                    self.fit_source = (('grown' if grown else 'trimmed') + ' from ' +
+                                       str(len(forest.estimators_)) + ' trees')
+                elif isinstance(self.regressor, RandomForestRegressor):
+                    # tree batches are cancellation points, other methods fit in one call
+                    grow_forest(self.regressor, self.model_config.options.n_estimators,
+                                self.samples_split[0], self.samples_split[2],
+                                self.checked(progress), max(FOREST_BATCH, n_workers))
+                else:
+                    self.regressor.fit(self.samples_split[0], self.samples_split[2])
+
+            if isinstance(self.regressor, HistGradientBoostingRegressor):
+                self.fit_source = str(self.regressor.n_iter_) + ' iterations'
+
+        self.stage('Fit', time_start, self.fit_samples(), 'samples')
+
+        if self.model_cache_size > 0:
+            self.model_cache[fit_key] = (self.regressor, self.print_parameters_info,
+                                         estimate_size(self.regressor))
+
+            # the newest model is held by the pipeline anyway, only older ones cost memory
+            while len(self.model_cache) > self.model_cache_size or (
+                    len(self.model_cache) > 1 and
+                    sum(nbytes for _, _, nbytes in self.model_cache.values()) > self.model_cache_bytes):
+                self.model_cache.popitem(last=False)
+
+        return self.regressor
+
+
+    def samples_key(self):
+        """ Identifies the current samples: source files, how they were read and turned into samples """
+
+        files = tuple(file_fingerprint(file) for file in self.sample_config.files)
+
+        image = None
+        if self.aggregate_config is not None or self.feature_config is not None:
+            image = file_fingerprint(self.img_loc)
+
+        return files, tuple(self.sample_config), self.aggregate_config, self.feature_config, image
+
+
+    def fit_key(self):
+        """ Model cache key of the current samples, model config and split """
+
+        model_config = self.model_config
+
+        return (
+            self.samples_key(),
+            model_config.depth_label, model_config.start_label, model_config.end_label,
+            model_config.limit, model_config.train_percent,
+            model_config.x_label, model_config.y_label, model_config.cell_size,
+            model_config.method, model_config.options
+        )
+
+
+    def cached_forest(self, fit_key):
+        """ A cached random forest differing from fit_key only in its number of trees
+
+        Prefers the smallest forest with enough trees, otherwise the largest.
+        """
+
+        if fit_key[-2] != METHODS[1]:
+            return None
+
+        n_estimators = fit_key[-1].n_estimators
+        other_trees = fit_key[-1]._replace(n_estimators=None)
+
+        forests = [
+            regressor for key, (regressor, _, _) in self.model_cache.items()
+            if key[:-1] == fit_key[:-1] and key[-1]._replace(n_estimators=None) == other_trees
+        ]
+        if not forests:
+            return None
+
+        larger = [forest for forest in forests if len(forest.estimators_) >= n_estimators]
+        if larger:
+            return min(larger, key=lambda forest: len(forest.estimators_))
+
+        return max(forests, key=lambda forest: len(forest.estimators_))
+
+
+    def fit_samples(self):
+        """ Number of samples the regressor was fitted on """
+
+        if self.streaming():
+            return getattr(self.regressor, 'n_samples_seen_', None)
+
+        return len(self.samples_split[0])
+
+
+    def predict(self, predict_config, progress=None):
+        """ Predict the whole image block by block into a temporary GeoTIFF """
+
+        self.check_cancelled()
+        time_start = self.start_stage()
+
+        self.remove_prediction()
+        self.predict_config = predict_config
+
+        predict_fd, self.predict_loc = tempfile.mkstemp(prefix='sdb_', suffix='.tif')
+        os.close(predict_fd)
+
+        try:
+            with create_prediction(self.predict_loc, self.image_raw) as z_predict:
+                self.npredicted = predict_blocks(
+                    self.regressor,
+                    self.image_raw,
+                    z_predict,
+                    self.model_config.limit,
+                    predict_config.memory_budget,
+                    self.checked(progress),
+                    predict_config.n_workers,
+                    predict_config.mask_loc,
+                    predict_config.water_ratio
+                )
+        except Cancelled:
+            self.remove_prediction()
+            raise
+
+        self.stage('Predict', time_start, self.image_raw.width * self.image_raw.height, 'pixels')
+
+        return self.predict_loc
+
+
+    def stream_chunks(self, progress=None):
+        """ Split chunks of the streamed samples, same split on every pass """
+
+        model_config = self.model_config
+
+        for chunk in stream_chunks(self.sample_chunks(progress), model_config.depth_label,
+                                   model_config.start_label, model_config.end_label,
+                                   model_config.train_percent, model_config.limit):
+            self.check_cancelled()
+            yield chunk
+
+
+    def validate(self, progress=None):
+
+        self.check_cancelled()
+        time_start = self.start_stage()
+
+        if self.streaming():
+            scores = StreamingScores()
+
+            for _, features_test, _, z_test in self.stream_chunks(progress):
+                if len(z_test):
+                    scores.update(z_test, self.regressor.predict(features_test))
+
+            self.scores = scores.scores()
+            ntest = scores.n
+        else:
+            self.scores = validate(self.regressor, self.samples_split[1], self.samples_split[3])
+            ntest = len(self.samples_split[3])
+
+        self.stage('Validate', time_start, ntest, 'samples')
+
+        return self.scores
+
+
+    def cross_validate(self, progress=None, n_jobs=-1):
+        """ Spatial k-fold scores over the grid cells of the model config """
+
+        self.check_cancelled()
+        time_start = self.start_stage()
+
+        model_config = self.model_config
+        features, z, rows, _ = self.filtered_samples()
+        cells = sample_cells(self.samples_raw, model_config.x_label, model_config.y_label,
+                             model_config.cell_size, rows)
+
+        with parallel_backend('threading', n_jobs=n_jobs):
+            self.cv_scores = cross_validate(self.regressor, features, z, cells, model_config.folds,
+                                            self.checked(progress))
+
+        self.stage('Cross Validation', time_start, len(z), 'samples')
+
+        return self.cv_scores
+
+
+    def feature_labels(self):
+        """ The sample columns the regressor was fitted on """
+
+        columns = list(self.samples_raw.columns)
+        start_loc = columns.index(self.model_config.start_label)
+        end_loc = columns.index(self.model_config.end_label)
+
+        return columns[start_loc:end_loc+1]
+
+
+    def save_model(self, model_loc, compress=None):
+        """ Store the fitted regressor with everything needed to predict other images
+
+        compress is the joblib zlib level, 0 writes an uncompressed file
+        that load_model memory maps. None leaves forests, the large
+        models, uncompressed and compresses the others at level 3.
+        """
+
+        regressor = self.regressor if self.model_artifact is None else self.model_artifact['regressor']
+        if compress is None:
+            compress = 0 if isinstance(regressor, RandomForestRegressor) else 3
+
+        if self.model_artifact is not None:
+            joblib.dump(self.model_artifact, model_loc, compress=compress)
+
+            return model_loc
+
+        artifact = {
+            'version': MODEL_VERSION,
+            'regressor': self.regressor,
+            'method': self.model_config.method,
+            'options': self.model_config.options._asdict(),
+            'features': self.feature_labels(),
+            'depth_label': self.model_config.depth_label,
+            'depth_flipped': self.depth_flipped,
+            'limit': self.model_config.limit,
+            'train_percent': self.model_config.train_percent,
+            'scores': None if self.scores is None else tuple(float(score) for score in self.scores),
+            'image': self.img_loc,
+            'crs': None if self.image_raw is None else str(self.image_raw.crs),
+            'samples': list(self.sample_config.files),
+            'created': datetime.datetime.now().isoformat()
+        }
+
+        joblib.dump(artifact, model_loc, compress=compress)
+
+        return model_loc
+
+
+    def load_model(self, model_loc):
+        """ Load a model stored by save_model, ready for predict without samples """
+
+        self.check_cancelled()
+        time_start = self.start_stage()
+
+        with warnings.catch_warnings():
+            # compressed artifacts can not be memory mapped and are read whole
+            warnings.simplefilter('ignore', UserWarning)
+            artifact = joblib.load(model_loc, mmap_mode='r')
+
+        if not isinstance(artifact, dict) or artifact.get('version') != MODEL_VERSION:
+            raise ValueError(model_loc + ' is not an SDB model of version ' + str(MODEL_VERSION))
+
+        options = METHOD_OPTIONS[artifact['method']](**artifact['options'])
+        features = artifact['features']
+
+        self.model_config = ModelConfig(
+            artifact['depth_label'],
+            features[0],
+            features[-1],
+            artifact['method'],
+            options,
+            artifact['train_percent'],
+            artifact['limit']
+        )
+        self.regressor = artifact['regressor']
+        self.print_parameters_info = build_regressor(artifact['method'], options)[1]
+        self.depth_flipped = artifact['depth_flipped']
+        self.scores = artifact['scores']
+        self.cv_scores = None
+        self.samples_split = None
+        self.split_key = None
+        self.split_cells = None
+        self.model_artifact = artifact
+        self.model_loc = model_loc
+
+        self.stage('Model Load', time_start)
+
+        return artifact
+
+
+    def check_model_bands(self, image_raw=None):
+
+        image_raw = self.image_raw if image_raw is None else image_raw
+
+        if self.model_artifact is not None:
+            nfeatures = len(self.model_artifact['features'])
+        else:
+            nfeatures = len(self.feature_labels())
+
+        if nfeatures != image_raw.count:
+            raise ValueError('The model was fitted on ' + str(nfeatures) + ' bands, ' +
+                             str(image_raw.name) + ' has ' + str(image_raw.count))
+
+
+    def run_model(self, predict_config, progress=None):
+        """ Predict the image with the loaded model, returns the result summary """
+
+        self.check_model_bands()
+        self.predict(predict_config, progress)
+
+        return self.model_info()
+
+
+    def predict_scenes(self, scenes, predict_config, driver='GTiff', progress=None,
+                       queue_size=4, output_config=OutputConfig()):
+        """ Predict a list of (image, save location) pairs with the current model
+
+        Reading, prediction and writing overlap across tiles and scenes.
+        Every output is encoded by the writer thread as soon as its scene
+        is complete. Returns one result dict per scene.
+        """
+
+        self.check_cancelled()
+        time_start = self.start_stage()
+
+        if self.regressor is None:
+            raise ValueError('Fit or load a model before predicting scenes')
+
+        images = [image for image, _ in scenes]
+        npixels = 0
+        for image in images:
+            with rio.open(image) as image_raw:
+                self.check_model_bands(image_raw)
+                npixels += image_raw.width * image_raw.height
+
+        outputs = []
+        for _ in scenes:
+            output_fd, output_loc = tempfile.mkstemp(prefix='sdb_', suffix='.tif')
+            os.close(output_fd)
+            outputs.append(output_loc)
+
+        finished = [None] * len(scenes)
+
+        def scene_done(i):
+            write_output(outputs[i], scenes[i][1], driver, *output_config)
+            os.remove(outputs[i])
+
+            finished[i] = datetime.datetime.now()
+
+        try:
+            npredicted = predict_scenes(
+                self.regressor,
+                images,
+                outputs,
+                self.model_config.limit,
+                predict_config.memory_budget,
+                self.checked(progress),
+                predict_config.mask_loc,
+                predict_config.water_ratio,
+                predict_config.n_workers,
+                queue_size,
+                scene_done
+            )
+        finally:
+            for output_loc in outputs:
+                if os.path.exists(output_loc):
+                    os.remove(output_loc)
+
+        self.output_config = None if driver in POINT_DRIVERS else output_config
+        self.scene_results = [
+            {'image': image, 'output': save_loc, 'npredicted': count, 'finished': done}
+            for (image, save_loc), count, done in zip(scenes, npredicted, finished)
+        ]
+
+        self.stage('Scene Predict', time_start, npixels, 'pixels')
+
+        return self.scene_results
+
+
+    def scenes_info(self):
+        """ Printable summary of the last predict_scenes run """
+
+        runtime = self.timings['Scene Predict']
+        npredicted = sum(result['npredicted'] for result in self.scene_results)
+
+        return (
+            ''.join(
+                result['image'] + ' -> ' + result['output'] + '\t' +
+                str(result['npredicted']) + ' pixels' + '\n'
+                for result in self.scene_results
+            ) + '\n' +
+            'Scenes:' + '\t\t' + str(len(self.scene_results)) + '\n' +
+            'Predicted Pixels:' + '\t' + str(npredicted) + '\n' +
+            'Prediction Runtime:' + '\t' + str(runtime) + '\n' +
+            self.print_model_speed('Scene Predict', npredicted) + '\n'
+        )
+
+
+    def tune(self, search_config, progress=None, n_jobs=-1):
+        """ Cross validate option sets of the model config method on the training data
+
+        Nothing is predicted; returns the leaderboard and the best options.
+        The split must have run before.
+        """
+
+        self.check_cancelled()
+        time_start = self.start_stage()
+
+        if self.streaming():
+            raise ValueError('Tuning needs the samples in memory')
+
+        model_config = self.model_config
+        features_train, z_train = self.samples_split[0], self.samples_split[2]
+        cells = self.split_cells
+
+        self.leaderboard, best = search_options(
+            model_config.method,
+            model_config.options,
+            search_config,
+            features_train,
+            z_train,
+            cells,
+            n_jobs,
+            self.checked(progress)
+        )
+        self.search_config = search_config
+
+        self.stage('Tune', time_start, len(features_train), 'samples')
+
+        return self.leaderboard, best
+
+
+    def run(self, model_config, predict_config, progress=None):
+        """ Split, fit, predict and validate, returns the result summary """
+
+        self.split(model_config)
+        self.fit(predict_config.n_workers)
+        self.predict(predict_config, progress)
+        self.validate()
+
+        if model_config.cell_size is not None and model_config.folds > 1:
+            self.cross_validate(n_jobs=predict_config.n_workers)
+
+        return self.result_info()
+
+
+    def sample_loc(self):
+
+        return ''.join(file + '\n' for file in self.sample_config.files)
+
+
+    def print_limit(self):
+
+        if self.model_config.limit is not None:
+            return 'Depth Limit:' + '\t\t' + str(self.model_config.limit)
+        else:
+            return 'Depth Limit:' + '\t\t' + 'Disabled'
+
+
+    def print_mask(self):
+
+        mask_loc = self.predict_config.mask_loc
+        water_ratio = self.predict_config.water_ratio
+
+        if mask_loc is not None and water_ratio is not None:
+            return 'Mask:' + '\t\t' + mask_loc + ', band ratio ' + str(water_ratio)
+        elif mask_loc is not None:
+            return 'Mask:' + '\t\t' + mask_loc
+        elif water_ratio is not None:
+            return 'Mask:' + '\t\t' + 'band ratio ' + str(water_ratio)
+        else:
+            return 'Mask:' + '\t\t' + 'Nodata only'
+
+
+    def model_bytes(self):
+        """ Pickled size of the current regressor, measured once per regressor """
+
+        if self.regressor_size is None or self.regressor_size[0] is not self.regressor:
+            self.regressor_size = (self.regressor, model_size(self.regressor))
+
+        return self.regressor_size[1]
+
+
+    def predict_speed(self, stage='Predict', npredicted=None):
+        """ Seconds of stage per megapixel sent to the regressor, None without pixels """
+
+        if npredicted is None:
+            npredicted = self.npredicted
+
+        if not npredicted or stage not in self.timings:
+            return None
+
+        return self.timings[stage].total_seconds() / npredicted * 1e6
+
+
+    def print_model_speed(self, stage='Predict', npredicted=None):
+
+        predict_speed = self.predict_speed(stage, npredicted)
+
+        return (
+            'Model Size:' + '\t\t' + str(round(self.model_bytes() / 2**10 / 2**10, 2)) + ' MB' + '\n' +
+            'Prediction Speed:' + '\t' +
+            ('no pixels predicted' if predict_speed is None else
+             str(round(predict_speed, 3)) + ' s per megapixel')
+        )
+
+
+    def model_info(self):
+        """ Printable summary of a prediction with a loaded model """
+
+        artifact = self.model_artifact
+
+        print_limit = self.print_limit()
+
+        if artifact['scores'] is not None:
+            print_scores = (
+                'RMSE:' + '\t\t' + str(artifact['scores'][0]) + '\n' +
+                'MAE:' + '\t\t' + str(artifact['scores'][1]) + '\n' +
+                'R\u00B2:' + '\t\t' + str(artifact['scores'][2])
+            )
+        else:
+            print_scores = 'RMSE:' + '\t\t' + 'not validated'
+
+        pixel_size_ar = pixel_size(self.image_raw)
+
+        return (
+            'Image Input:' + '\t\t' + self.img_loc + ' (' +
+            str(round(self.img_size / 2**10 / 2**10, 2)) + ' MB)' + '\n' +
+            'Model:' + '\t\t' + self.model_loc + '\n' +
+            'Fitted On:' + '\t\t' + str(artifact['image']) + ' (' + artifact['created'] + ')' + '\n' +
+            'Features:' + '\t\t' + ', '.join(str(label) for label in artifact['features']) + '\n\n' +
+            print_limit + '\n' +
+            self.print_mask() + '\n' +
+            'Predicted Pixels:' + '\t' + str(self.npredicted) + ' of ' +
+            str(self.image_raw.width * self.image_raw.height) + '\n\n' +
+            'Method:' + '\t\t' + self.model_config.method + '\n' +
+            self.print_parameters_info + '\n\n' +
+            'Training Validation' + '\n' +
+            print_scores + '\n\n' +
+            'Prediction Runtime:' + '\t' + str(self.timings['Predict']) + '\n' +
+            self.print_model_speed() + '\n\n' +
+            'CRS:' + '\t\t' + str(self.image_raw.crs) +'\n'
+            'Dimensions:' + '\t\t' + str(self.image_raw.width) + ' x ' +
+            str(self.image_raw.height) + ' pixels' + '\n'
+            'Pixel Size:' + '\t\t' + str(pixel_size_ar[0]) + ' , ' +
+            str(pixel_size_ar[1]) + '\n\n'
+        )
+
+
+    def result_info(self):
+        """ Printable summary of the last prediction run """
+
+        if self.model_loc is not None:
+            return self.model_info()
+
+        print_limit = self.print_limit()
+
+        if self.feature_config is not None:
+            print_features = (
+                'Band Values:' + '\t\t' + 'image at ' + str(self.feature_config.x_label) + ', ' +
+                str(self.feature_config.y_label) + ' (' +
+                str(self.feature_config.crs or 'image CRS') + ')'
+            )
+        else:
+            print_features = 'Band Values:' + '\t\t' + 'sample columns'
+
+        if self.aggregate_config is not None:
+            print_features = (
+                'Aggregation:' + '\t\t' + self.aggregate_config.statistic + ' per pixel, stride ' +
+                str(self.aggregate_config.stride) + ' (' + str(len(self.samples_loaded)) +
+                ' soundings to ' + str(len(self.samples_aggregated)) + ' pixels)' + '\n' +
+                print_features
+            )
+
+        print_mask = self.print_mask()
+
+        runtime = [
+            self.timings['Split'] + self.timings['Fit'],
+            self.timings['Predict'],
+            self.timings['Validate'],
+        ]
+        runtime.append(runtime[0] + runtime[1] + runtime[2])
+
+        if self.model_config.cell_size is not None:
+            print_split = (
+                'Split:' + '\t\t' + 'spatial cells of ' + str(self.model_config.cell_size) + ' (' +
+                str(self.model_config.x_label) + ', ' + str(self.model_config.y_label) + ')'
+            )
+        else:
+            print_split = 'Split:' + '\t\t' + 'random rows'
+
+        print_cv = ''
+        if self.cv_scores is not None:
+            cv_mean = self.cv_scores.mean(axis=0)
+            cv_std = self.cv_scores.std(axis=0)
+
+            print_cv = (
+                '\n\n' + 'Spatial ' + str(len(self.cv_scores)) + '-Fold CV' + '\n' +
+                'RMSE:' + '\t\t' + str(cv_mean[0]) + ' \u00B1 ' + str(cv_std[0]) + '\n' +
+                'MAE:' + '\t\t' + str(cv_mean[1]) + ' \u00B1 ' + str(cv_std[1]) + '\n' +
+                'R\u00B2:' + '\t\t' + str(cv_mean[2]) + ' \u00B1 ' + str(cv_std[2])
+            )
+
+        print_fit_source = ''
+        if self.fit_source is not None:
+            print_fit_source = ' (' + self.fit_source + ')'
+
+        train_percent = self.model_config.train_percent
+        pixel_size_ar = pixel_size(self.image_raw)
+
+        return (
+            'Image Input:' + '\t\t' + self.img_loc + ' (' +
+            str(round(self.img_size / 2**10 / 2**10, 2)) + ' MB)' + '\n' +
+            'Sample Data:' + '\t\t' + self.sample_loc() + ' (' +
+            str(round(self.sample_size / 2**10 / 2**10, 2)) + ' MB)' + '\n' +
+            print_features + '\n\n' +
+            print_limit + '\n' +
+            print_mask + '\n' +
+            'Predicted Pixels:' + '\t' + str(self.npredicted) + ' of ' +
+            str(self.image_raw.width * self.image_raw.height) + '\n' +
+            'Train Data:' + '\t\t' + str(train_percent) + ' %' + '\n'
+            'Test Data:' + '\t\t' + str(100 - train_percent) + ' %' + '\n' +
+            print_split + '\n\n'
+            'Method:' + '\t\t' + self.model_config.method + '\n' +
+            self.print_parameters_info + '\n\n'
+            'RMSE:' + '\t\t' + str(self.scores[0]) + '\n' +
+            'MAE:' + '\t\t' + str(self.scores[1]) + '\n' +
+            'R\u00B2:' + '\t\t' + str(self.scores[2]) +
+            print_cv + '\n\n' +
+            'Fitting Runtime:' + '\t\t' + str(runtime[0]) + print_fit_source + '\n' +
+            'Prediction Runtime:' + '\t' + str(runtime[1]) + '\n' +
+            'Validating Runtime:' + '\t' + str(runtime[2]) + '\n' +
+            'Overall Runtime:' + '\t' + str(runtime[3]) + '\n' +
+            self.print_model_speed() + '\n\n' +
+            'CRS:' + '\t\t' + str(self.image_raw.crs) +'\n'
+            'Dimensions:' + '\t\t' + str(self.image_raw.width) + ' x ' +
+            str(self.image_raw.height) + ' pixels' + '\n'
+            'Pixel Size:' + '\t\t' + str(pixel_size_ar[0]) + ' , ' +
+            str(pixel_size_ar[1]) + '\n\n'
+        )
+
+
+    def save(self, save_loc, driver='GTiff', report=True, output_config=OutputConfig()):
+        """ Encode the temporary prediction into save_loc, optionally with a report """
+
+        self.check_cancelled()
+        time_start = self.start_stage()
+
+        # text points have no raster encoding to report
+        self.output_config = None if driver in POINT_DRIVERS else output_config
+        write_output(self.predict_loc, save_loc, driver, *output_config)
+
+        self.stage('Save', time_start, self.image_raw.width * self.image_raw.height, 'pixels')
+
+        if report:
+            return self.write_report(save_loc)
+
+
+    def write_report(self, save_loc):
+        """ Write the run summary next to the saved prediction """
+
+        report_save_loc = os.path.splitext(save_loc)[0] + '_report.txt'
+        new_img_size = os.path.getsize(save_loc)
+
+        print_stages = ''.join(
+            name + ':\t' + str(runtime) + self.print_profile(name) + '\n'
+            for name, runtime in self.timings.items())
+
+        print_search = ''
+        if self.leaderboard is not None:
+            print_search = (
+                'Search:' + '\t\t' + self.search_config.strategy + ', ' +
+                str(self.search_config.folds) + ' folds' + '\n' +
+                self.leaderboard.head(10).to_string() + '\n\n'
+            )
+
+        with open(report_save_loc, 'w') as report:
+            report.write(
+                self.result_info() +
+                print_search +
+                print_stages + '\n' +
+                'Output:' + '\t\t' + save_loc + ' (' +
+                str(round(new_img_size / 2**10 / 2**10, 2)) + ' MB)' + '\n' +
+                self.print_output()
+            )
+
+        self.write_profile(os.path.splitext(save_loc)[0], save_loc)
+
+        return report_save_loc
+
+
+    def print_profile(self, name):
+
+        profile = self.profiles.get(name)
+        if profile is None:
+            return ''
+
+        print_rate = ''
+        if profile['rate_per_s'] is not None:
+            print_rate = ', ' + str(round(profile['rate_per_s'])) + ' ' + profile['unit'] + '/s'
+
+        print_rss = ''
+        if profile['rss_start_mb'] is not None and profile['rss_end_mb'] is not None:
+            print_rss = (', RSS ' + str(round(profile['rss_start_mb'])) + ' -> ' +
+                         str(round(profile['rss_end_mb'])) + ' MB')
+        if profile['process_peak_rss_mb'] is not None:
+            print_rss += ', process peak ' + str(round(profile['process_peak_rss_mb'])) + ' MB'
+
+        return '\t(CPU ' + str(round(profile['cpu_s'], 2)) + ' s' + print_rate + print_rss + ')'
+
+
+    def run_report(self, save_loc=None):
+        """ Machine readable summary of the run with the profile of every stage """
+
+        image = None
+        if self.image_raw is not None:
+            image = {
+                'path': self.img_loc,
+                'width': self.image_raw.width,
+                'height': self.image_raw.height,
+                'bands': self.image_raw.count,
+                'mb': self.img_size / 2**20
+            }
+
+        model = None
+        if self.model_config is not None:
+            options = self.model_config.options
+            model = {
+                'method': self.model_config.method,
+                'options': options._asdict() if hasattr(options, '_asdict') else options,
+                'loaded_from': self.model_loc,
+                'size_mb': None if self.regressor is None else self.model_bytes() / 2**20,
+                'predict_s_per_mpx': self.predict_speed()
+            }
+
+        peak = peak_rss()
+
+        return {
+            'created': datetime.datetime.now().isoformat(),
+            'machine': machine_info(),
+            'image': image,
+            'samples': None if self.sample_config is None else list(self.sample_config.files),
+            'nsamples': None if self.samples_raw is None or self.streaming() else len(self.samples_raw),
+            'model': model,
+            'scores': None if self.scores is None else dict(zip(('rmse', 'mae', 'r2'), self.scores)),
+            'npredicted': self.npredicted,
+            'output': save_loc,
+            'output_mb': None if save_loc is None else os.path.getsize(save_loc) / 2**20,
+            'process_peak_rss_mb': None if peak is None else peak / 2**20,
+            'stages': list(self.profiles.values())
+        }
+
+
+    def write_profile(self, report_stem, save_loc=None):
+        """ Write the run report as report_stem_report.json and the stages as report_stem_stages.csv
+
+        Each stage row carries the run time and processor, so the CSV
+        files of many runs can be concatenated to track throughput.
+        """
+
+        run_report = self.run_report(save_loc)
+
+        with open(report_stem + '_report.json', 'w') as report:
+            json.dump(run_report, report, indent=2,
+                      default=lambda value: value.item() if hasattr(value, 'item') else str(value))
+
+        stages = pd.DataFrame(run_report['stages'])
+        stages.insert(0, 'run', run_report['created'])
+        stages.insert(1, 'processor', run_report['machine']['processor'])
+        stages.insert(2, 'cpu_count', run_report['machine']['cpu_count'])
+        stages.to_csv(report_stem + '_stages.csv', index=False)
+
+        return report_stem + '_report.json'
+
+
+    def print_output(self):
+
+        output_config = self.output_config
+        if output_config is None:
+            return ''
+
+        nodata = output_config.nodata
+        if nodata is None:
+            nodata = DEFAULT_NODATA[output_config.dtype]
+
+        print_dtype = output_config.dtype
+        if output_config.dtype == 'int16':
+            print_dtype += ' (x ' + str(output_config.scale) + ' m)'
+
+        return (
+            'Encoding:' + '\t' + print_dtype + ', ' + output_config.compress + ', nodata ' +
+            str(nodata) + (', overviews' if output_config.overviews else '') + '\n'
+        )
+
+
+    def remove_prediction(self):
+
+        if self.predict_loc is not None and os.path.exists(self.predict_loc):
+            os.remove(self.predict_loc)
+
+        self.predict_loc = None
+
+
+    def close(self):
+
+        self.remove_prediction()
+
+        if self.image_raw is not None:
+            self.image_raw.close()
+            self.image_raw = None
@@ -1,9 +1,3 @@
-from sklearn import metrics
-from sklearn.linear_model import LinearRegression
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.svm import SVR
-from sklearn.model_selection import train_test_split
-from joblib import parallel_backend
 import sklearn.neighbors
 import sklearn.utils._cython_blas
 import sklearn.tree
@@ -17,33 +11,111 @@ import rasterio.control
 import rasterio.crs
 import rasterio.sample
 import rasterio.vrt
+from sdb_raster import COMPRESSIONS, DEPTH_TYPES, resolve_workers
+from sdb_cache import SampleCache
+from sdb_core import (METHODS, METHOD_OPTIONS, MLROptions, RFOptions, SVMOptions,
+                      IncrementalLROptions, ApproxSVMOptions, HGBOptions, SEPARATORS, SearchConfig,
+                      X_HEADERS, Y_HEADERS, FORMATS, SampleConfig, AggregateConfig, FeatureConfig, ModelConfig,
+                      PredictConfig, OutputConfig, SDBPipeline, Cancelled, resource_path)
 from pathlib import Path
+from typing import Union
 import glob
 import sys, os
-import datetime
-from PyQt5.QtCore import Qt
+import multiprocessing
+import traceback
+from PyQt5.QtCore import Qt, QThread, pyqtSignal, QAbstractTableModel, QModelIndex
 from PyQt5.QtWidgets import(QApplication, QWidget, QTextBrowser, QProgressBar, QFileDialog, QDialog,
                             QGridLayout, QMessageBox, QVBoxLayout, QComboBox, QLabel, QCheckBox,
-                            QPushButton, QDoubleSpinBox, QSpinBox, QRadioButton, QTableWidgetItem,
-                            QTableWidget, QScrollArea, QHeaderView)
+                            QPushButton, QDoubleSpinBox, QSpinBox, QRadioButton, QTableView,
+                            QScrollArea, QHeaderView, QLineEdit)
 from PyQt5.QtGui import QIcon
 
-def resource_path(relative_path):
-    """ Get the absolute path to the resource, works for dev and for PyInstaller """
-    try:
-        # PyInstaller creates a temp folder and stores path in _MEIPASS
-        base_path = sys._MEIPASS
-    except Exception:
-        base_path = os.path.abspath(".")
-    return os.path.join(base_path, relative_path)
-
-
+# the PyInstaller bundle ships its own PROJ and GDAL data, other installs keep theirs
 # os.environ['PROJ_LIB'] = os.path.expanduser('~\\.conda\\envs\\sdb_exe\\Library\\share\\proj')
 # os.environ['GDAL_DATA'] = os.path.expanduser('~\\.conda\\envs\\sdb_exe\\Library\\share')
 # os.environ['PROJ_LIB'] = os.path.expanduser('~/.conda/envs/sdb_exe/Library/share/proj')
 # os.environ['GDAL_DATA'] = os.path.expanduser('~/.conda/envs/sdb_exe/Library/share')
-os.environ['PROJ_LIB'] = resource_path('share/proj')
-os.environ['GDAL_DATA'] = resource_path('share')
+if getattr(sys, '_MEIPASS', None):
+    os.environ['PROJ_LIB'] = resource_path('share/proj')
+    os.environ['GDAL_DATA'] = resource_path('share')
+
+
+class Worker(QThread):
+    '''Run a long pipeline task outside of the GUI thread'''
+
+    step = pyqtSignal(int, str) # progress bar step, status text
+    progress = pyqtSignal(int, int, str) # done, total, progress bar format
+    result = pyqtSignal(object)
+    error = pyqtSignal(str)
+
+    def __init__(self, task):
+
+        super(Worker, self).__init__()
+        self.task = task
+
+
+    def run(self):
+
+        try:
+            self.result.emit(self.task(self))
+        except Cancelled:
+            self.error.emit('Cancelled')
+        except Exception:
+            self.error.emit(traceback.format_exc())
+
+
+
+class DataFrameModel(QAbstractTableModel):
+    '''Read-only table model rendering DataFrame cells on demand'''
+
+    def __init__(self, data=None):
+
+        super(DataFrameModel, self).__init__()
+        self.setDataFrame(data)
+
+
+    def setDataFrame(self, data):
+
+        self.beginResetModel()
+
+        if data is None:
+            data = pd.DataFrame()
+
+        self.headers = [str(column) for column in data.columns]
+        self.nrows = len(data.index)
+        # one array per column, cells are only formatted when Qt asks for them
+        self.columns = [np.asarray(data.iloc[:, j]) for j in range(len(data.columns))]
+
+        self.endResetModel()
+
+
+    def rowCount(self, parent=QModelIndex()):
+
+        return 0 if parent.isValid() else self.nrows
+
+
+    def columnCount(self, parent=QModelIndex()):
+
+        return 0 if parent.isValid() else len(self.columns)
+
+
+    def data(self, index, role=Qt.DisplayRole):
+
+        if index.isValid() and role == Qt.DisplayRole:
+            return str(self.columns[index.column()][index.row()])
+
+        return None
+
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+
+        if role != Qt.DisplayRole:
+            return None
+
+        if orientation == Qt.Horizontal:
+            return self.headers[section]
+        else:
+            return str(section + 1)
 
 
 
@@ -54,35 +126,18 @@ class SDBWidget(QWidget):
         super(SDBWidget, self).__init__()
 
 ####### Default Values #######
-        global njobs
-        njobs = -1
-
-        global method_list
-        method_list = [
-            'Multiple Linear Regression',
-            'Random Forest', 
-            'Support Vector Machines'
-        ]
+        self.pipeline = SDBPipeline(SampleCache())
+        self.predict_config = PredictConfig()
+        self.output_config = OutputConfig()
 
-        global mlr_op_list
-        mlr_op_list = [
-            True, # fit_intercept
-            False, # normalize
-            True # copy_X
-        ]
+        self.method_options = {method: options() for method, options in METHOD_OPTIONS.items()}
 
-        global rf_op_list
-        rf_op_list = [
-            300, # n_estimators
-            'mse' # criterion
-        ]
+        self.img_loc = ''
+        self.filesList = []
+        self.save_loc = ''
 
-        global svm_op_list
-        svm_op_list = [
-            'rbf', # kernel
-            .1, # gamma
-            1000.0 # C
-        ]
+        self.worker = None
+        self.closing = False
 ####### Default Values #######
 
         self.initUI()
@@ -94,13 +149,13 @@ class SDBWidget(QWidget):
         self.setWindowTitle('Satellite Derived Bathymetry')
         self.setWindowIcon(QIcon(resource_path('satellite.png')))
 
-        loadImageButton = QPushButton('Load Image')
-        loadImageButton.clicked.connect(self.loadImageDialog)
+        self.loadImageButton = QPushButton('Load Image')
+        self.loadImageButton.clicked.connect(self.loadImageDialog)
         self.loadImageLabel = QLabel()
         self.loadImageLabel.setAlignment(Qt.AlignCenter)
 
-        loadSampleButton = QPushButton('Load Sample')
-        loadSampleButton.clicked.connect(self.loadSampleDialog)
+        self.loadSampleButton = QPushButton('Load Sample')
+        self.loadSampleButton.clicked.connect(self.loadSampleDialog)
         self.loadSampleLabel = QLabel()
         self.loadSampleLabel.setAlignment(Qt.AlignCenter)
 
@@ -112,7 +167,32 @@ class SDBWidget(QWidget):
         bandEndLabel = QLabel('Last Band Column:')
         self.bandEndCB = QComboBox()
 
-        self.table = QTableWidget()
+        xLabel = QLabel('X Column:')
+        self.xCB = QComboBox()
+        yLabel = QLabel('Y Column:')
+        self.yCB = QComboBox()
+
+        sampleCRSLabel = QLabel('Sample CRS:')
+        self.sampleCRSLine = QLineEdit()
+        self.sampleCRSLine.setPlaceholderText('Image CRS')
+        self.extractButton = QPushButton('Extract Bands')
+        self.extractButton.clicked.connect(self.extractAction)
+
+        statisticLabel = QLabel('Pixel Aggregation:')
+        self.statisticCB = QComboBox()
+        self.statisticCB.addItems(['median', 'mean'])
+        strideLabel = QLabel('Pixel Stride:')
+        self.strideSB = QSpinBox()
+        self.strideSB.setRange(1, 100)
+        self.strideSB.setValue(1)
+        self.strideSB.setAlignment(Qt.AlignRight)
+        self.aggregateButton = QPushButton('Aggregate')
+        self.aggregateButton.clicked.connect(self.aggregateAction)
+
+        self.sampleModel = DataFrameModel()
+        self.table = QTableView()
+        self.table.setModel(self.sampleModel)
+        self.table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
         scroll = QScrollArea()
         scroll.setWidget(self.table)
 
@@ -130,9 +210,16 @@ class SDBWidget(QWidget):
         methodLabel = QLabel('Regression Method:')
         self.methodCB = QComboBox()
 
-        self.methodCB.addItems(method_list)
+        self.methodCB.addItems(METHODS)
         self.methodCB.activated.connect(self.methodSelection)
 
+        workersLabel = QLabel('Workers:')
+        self.workersSB = QSpinBox()
+        self.workersSB.setRange(1, os.cpu_count())
+        self.workersSB.setValue(resolve_workers(self.predict_config.n_workers))
+        self.workersSB.setAlignment(Qt.AlignRight)
+        self.workersSB.valueChanged.connect(self.workersSBState)
+
         trainPercentLabel = QLabel('Train Data (Percent):')
         self.trainPercentDSB = QDoubleSpinBox()
         self.trainPercentDSB.setRange(10.0, 90.0)
@@ -140,14 +227,45 @@ class SDBWidget(QWidget):
         self.trainPercentDSB.setValue(75.0)
         self.trainPercentDSB.setAlignment(Qt.AlignRight)
 
+        splitLabel = QLabel('Test Split:')
+        self.splitCB = QComboBox()
+        self.splitCB.addItems(['Random Rows', 'Spatial Blocks'])
+
+        cellSizeLabel = QLabel('Block Size (X/Y Units):')
+        self.cellSizeDSB = QDoubleSpinBox()
+        self.cellSizeDSB.setRange(.000001, 1000000)
+        self.cellSizeDSB.setDecimals(6)
+        self.cellSizeDSB.setValue(1000.0)
+        self.cellSizeDSB.setAlignment(Qt.AlignRight)
+
+        foldsLabel = QLabel('Spatial CV Folds:')
+        self.foldsSB = QSpinBox()
+        self.foldsSB.setRange(0, 100)
+        self.foldsSB.setValue(0)
+        self.foldsSB.setSpecialValueText('Off')
+        self.foldsSB.setAlignment(Qt.AlignRight)
+
         self.optionsButton = QPushButton('Options')
         self.optionsButton.clicked.connect(self.mlrOptionDialog)
         self.optionsButton.clicked.connect(self.methodSelection)
 
-        makePredictionButton = QPushButton('Make Prediction')
-        makePredictionButton.clicked.connect(self.predict)
-        saveFileButton = QPushButton('Save Into File')
-        saveFileButton.clicked.connect(self.saveOptionDialog)
+        self.tuneButton = QPushButton('Tune')
+        self.tuneButton.clicked.connect(self.tuneDialog)
+
+        self.makePredictionButton = QPushButton('Make Prediction')
+        self.makePredictionButton.clicked.connect(self.predict)
+        self.batchPredictButton = QPushButton('Batch Predict')
+        self.batchPredictButton.clicked.connect(self.batchPredictDialog)
+        self.saveFileButton = QPushButton('Save Into File')
+        self.saveFileButton.clicked.connect(self.saveOptionDialog)
+
+        self.saveModelButton = QPushButton('Save Model')
+        self.saveModelButton.clicked.connect(self.saveModelAction)
+        self.loadModelButton = QPushButton('Load Model')
+        self.loadModelButton.clicked.connect(self.loadModelAction)
+        self.useModelCheckBox = QCheckBox('Predict With Loaded Model')
+        self.useModelCheckBox.setChecked(False)
+        self.useModelCheckBox.setEnabled(False)
 
         resultInfo = QLabel('Result Information')
         self.resultText = QTextBrowser()
@@ -158,6 +276,10 @@ class SDBWidget(QWidget):
         self.progressBar.setMinimum(0)
         self.progressBar.setMaximum(4)
 
+        self.cancelButton = QPushButton('Cancel')
+        self.cancelButton.setEnabled(False)
+        self.cancelButton.clicked.connect(self.pipeline.cancel)
+
         aboutButton = QPushButton('About')
         aboutButton.clicked.connect(self.aboutDialog)
 
@@ -165,10 +287,10 @@ class SDBWidget(QWidget):
         grid = QGridLayout()
         vbox = QVBoxLayout()
 
-        grid.addWidget(loadImageButton, 1, 1, 1, 2)
+        grid.addWidget(self.loadImageButton, 1, 1, 1, 2)
         grid.addWidget(self.loadImageLabel, 1, 3, 1, 2)
 
-        grid.addWidget(loadSampleButton, 2, 1, 1, 2)
+        grid.addWidget(self.loadSampleButton, 2, 1, 1, 2)
         grid.addWidget(self.loadSampleLabel, 2, 3, 1, 2)
 
         grid.addWidget(depthHeaderLabel, 3, 1, 1, 1)
@@ -179,7 +301,22 @@ class SDBWidget(QWidget):
         grid.addWidget(bandEndLabel, 4, 3, 1, 1)
         grid.addWidget(self.bandEndCB, 4, 4, 1, 1)
 
-        grid.addWidget(self.table, 5, 1, 5, 4)
+        grid.addWidget(xLabel, 5, 1, 1, 1)
+        grid.addWidget(self.xCB, 5, 2, 1, 1)
+        grid.addWidget(yLabel, 5, 3, 1, 1)
+        grid.addWidget(self.yCB, 5, 4, 1, 1)
+
+        grid.addWidget(sampleCRSLabel, 6, 1, 1, 1)
+        grid.addWidget(self.sampleCRSLine, 6, 2, 1, 1)
+        grid.addWidget(self.aggregateButton, 6, 3, 1, 1)
+        grid.addWidget(self.extractButton, 6, 4, 1, 1)
+
+        grid.addWidget(statisticLabel, 7, 1, 1, 1)
+        grid.addWidget(self.statisticCB, 7, 2, 1, 1)
+        grid.addWidget(strideLabel, 7, 3, 1, 1)
+        grid.addWidget(self.strideSB, 7, 4, 1, 1)
+
+        grid.addWidget(self.table, 8, 1, 2, 4)
 
         grid.addWidget(limitLabel, 10, 1, 1, 1)
         grid.addWidget(self.limitSB, 10, 2, 1, 1)
@@ -191,18 +328,36 @@ class SDBWidget(QWidget):
         grid.addWidget(trainPercentLabel, 12, 1, 1, 1)
         grid.addWidget(self.trainPercentDSB, 12, 2, 1, 1)
 
-        grid.addWidget(self.optionsButton, 12, 3, 1, 2)
+        grid.addWidget(self.optionsButton, 12, 3, 1, 1)
+        grid.addWidget(self.tuneButton, 12, 4, 1, 1)
 
-        grid.addWidget(makePredictionButton, 13, 1, 1, 2)
-        grid.addWidget(saveFileButton, 13, 3, 1, 2)
+        grid.addWidget(workersLabel, 13, 1, 1, 1)
+        grid.addWidget(self.workersSB, 13, 2, 1, 1)
 
-        grid.addWidget(resultInfo, 14, 1, 1, 2)
-        grid.addWidget(self.resultText, 15, 1, 1, 4)
+        grid.addWidget(splitLabel, 14, 1, 1, 1)
+        grid.addWidget(self.splitCB, 14, 2, 1, 1)
+        grid.addWidget(cellSizeLabel, 14, 3, 1, 1)
+        grid.addWidget(self.cellSizeDSB, 14, 4, 1, 1)
+
+        grid.addWidget(foldsLabel, 15, 1, 1, 1)
+        grid.addWidget(self.foldsSB, 15, 2, 1, 1)
+
+        grid.addWidget(self.makePredictionButton, 16, 1, 1, 1)
+        grid.addWidget(self.batchPredictButton, 16, 2, 1, 1)
+        grid.addWidget(self.saveFileButton, 16, 3, 1, 2)
+
+        grid.addWidget(self.saveModelButton, 17, 1, 1, 1)
+        grid.addWidget(self.loadModelButton, 17, 2, 1, 1)
+        grid.addWidget(self.useModelCheckBox, 17, 3, 1, 2)
+
+        grid.addWidget(resultInfo, 18, 1, 1, 2)
+        grid.addWidget(self.resultText, 19, 1, 1, 4)
 
         vbox.addStretch(1)
         grid.addLayout(vbox, 21, 1)
 
-        grid.addWidget(self.progressBar, 22, 1, 1, 4)
+        grid.addWidget(self.progressBar, 22, 1, 1, 3)
+        grid.addWidget(self.cancelButton, 22, 4, 1, 1)
 
         grid.addWidget(aboutButton, 23, 1, 1, 4)
         self.setLayout(grid)
@@ -222,17 +377,31 @@ class SDBWidget(QWidget):
             self.limitState.setText('unchecked')
 
 
+    def workersSBState(self):
+
+        self.predict_config = self.predict_config._replace(n_workers=self.workersSB.value())
+
+
     def methodSelection(self):
 
-        if self.methodCB.currentText() == method_list[0]:
+        if self.methodCB.currentText() == METHODS[0]:
             self.optionsButton.clicked.disconnect()
             self.optionsButton.clicked.connect(self.mlrOptionDialog)
-        elif self.methodCB.currentText() == method_list[1]:
+        elif self.methodCB.currentText() == METHODS[1]:
             self.optionsButton.clicked.disconnect()
             self.optionsButton.clicked.connect(self.rfOptionDialog)
-        elif self.methodCB.currentText() == method_list[2]:
+        elif self.methodCB.currentText() == METHODS[2]:
             self.optionsButton.clicked.disconnect()
             self.optionsButton.clicked.connect(self.svmOptionDialog)
+        elif self.methodCB.currentText() == METHODS[3]:
+            self.optionsButton.clicked.disconnect()
+            self.optionsButton.clicked.connect(self.incrementalOptionDialog)
+        elif self.methodCB.currentText() == METHODS[4]:
+            self.optionsButton.clicked.disconnect()
+            self.optionsButton.clicked.connect(self.approxSVMOptionDialog)
+        elif self.methodCB.currentText() == METHODS[5]:
+            self.optionsButton.clicked.disconnect()
+            self.optionsButton.clicked.connect(self.hgbOptionDialog)
 
 
     def loadImageDialog(self):
@@ -247,6 +416,38 @@ class SDBWidget(QWidget):
         locLabel = QLabel('Location:')
         self.locList = QTextBrowser()
 
+        openMaskButton = QPushButton('Open Mask File')
+        openMaskButton.clicked.connect(self.maskFileDialog)
+        self.maskLocLabel = QLabel()
+
+        self.waterRatioCheckBox = QCheckBox('Predict Only Where Band Ratio Exceeds Threshold')
+        self.waterRatioCheckBox.setChecked(False)
+
+        ratioFirstLabel = QLabel('First Band:')
+        self.ratioFirstSB = QSpinBox()
+        self.ratioFirstSB.setRange(1, 100)
+        self.ratioFirstSB.setValue(2)
+        self.ratioFirstSB.setAlignment(Qt.AlignRight)
+
+        ratioSecondLabel = QLabel('Second Band:')
+        self.ratioSecondSB = QSpinBox()
+        self.ratioSecondSB.setRange(1, 100)
+        self.ratioSecondSB.setValue(4)
+        self.ratioSecondSB.setAlignment(Qt.AlignRight)
+
+        ratioThresholdLabel = QLabel('Threshold:')
+        self.ratioThresholdDSB = QDoubleSpinBox()
+        self.ratioThresholdDSB.setRange(-1, 1)
+        self.ratioThresholdDSB.setDecimals(3)
+        self.ratioThresholdDSB.setValue(0)
+        self.ratioThresholdDSB.setAlignment(Qt.AlignRight)
+
+        memoryLabel = QLabel('Memory Budget (MB):')
+        self.memorySB = QSpinBox()
+        self.memorySB.setRange(16, 65536)
+        self.memorySB.setValue(self.predict_config.memory_budget // 2**20)
+        self.memorySB.setAlignment(Qt.AlignRight)
+
         cancelButton = QPushButton('Cancel')
         cancelButton.clicked.connect(loadImage.close)
         loadButton = QPushButton('Load')
@@ -260,8 +461,23 @@ class SDBWidget(QWidget):
 
         grid.addWidget(self.locList, 5, 1, 10, 4)
 
-        grid.addWidget(loadButton, 15, 3, 1, 1)
-        grid.addWidget(cancelButton, 15, 4, 1, 1)
+        grid.addWidget(openMaskButton, 15, 1, 1, 2)
+        grid.addWidget(self.maskLocLabel, 15, 3, 1, 2)
+
+        grid.addWidget(self.waterRatioCheckBox, 16, 1, 1, 4)
+
+        grid.addWidget(ratioFirstLabel, 17, 1, 1, 1)
+        grid.addWidget(self.ratioFirstSB, 17, 2, 1, 1)
+        grid.addWidget(ratioSecondLabel, 17, 3, 1, 1)
+        grid.addWidget(self.ratioSecondSB, 17, 4, 1, 1)
+
+        grid.addWidget(ratioThresholdLabel, 18, 1, 1, 1)
+        grid.addWidget(self.ratioThresholdDSB, 18, 2, 1, 1)
+
+        grid.addWidget(memoryLabel, 19, 1, 1, 1)
+        grid.addWidget(self.memorySB, 19, 2, 1, 1)
+        grid.addWidget(loadButton, 19, 3, 1, 1)
+        grid.addWidget(cancelButton, 19, 4, 1, 1)
 
         loadImage.setLayout(grid)
 
@@ -275,36 +491,53 @@ class SDBWidget(QWidget):
         selectedFilter = 'GeoTIFF (*.tif)'
         fname = QFileDialog.getOpenFileName(self, 'Open File(s)', home_dir, fileFilter, selectedFilter)
 
-        global img_loc
-        img_loc = fname[0]
+        self.img_loc = fname[0]
+
+        self.locList.setText(self.img_loc)
 
-        global img_size
-        img_size = os.path.getsize(img_loc)
 
-        self.locList.setText(img_loc)
+    def maskFileDialog(self):
+
+        home_dir = str(Path.home())
+        fileFilter = 'All Files (*.*) ;; GeoTIFF (*.tif)'
+        selectedFilter = 'GeoTIFF (*.tif)'
+        fname = QFileDialog.getOpenFileName(self, 'Open Mask File', home_dir, fileFilter, selectedFilter)
+
+        self.maskLocLabel.setText(fname[0])
 
 
     def loadImageAction(self):
 
-        global image_raw
-        image_raw = rio.open(img_loc)
+        img_loc = self.img_loc
+        memory_budget = self.memorySB.value() * 2**20
+        mask_loc = self.maskLocLabel.text() or None
 
-        nbands = len(image_raw.indexes)
-        ndata = image_raw.read(1).size
-        bands_dummy = np.zeros((nbands, ndata))
-        for i in range(1, nbands + 1):
-            bands_dummy[i - 1, :] = np.ravel(image_raw.read(i))
+        if self.waterRatioCheckBox.isChecked():
+            ratio_bands = [self.ratioFirstSB.value(), self.ratioSecondSB.value()]
+            water_ratio = (ratio_bands[0], ratio_bands[1], self.ratioThresholdDSB.value())
+        else:
+            water_ratio = None
 
-        global bands_array
-        bands_array = bands_dummy.T
+        def imageLoaded(image_raw):
 
-        coord1 = np.array(image_raw.transform * (0, 0))
-        coord2 = np.array(image_raw.transform * (1, 1))
+            ratio = water_ratio
 
-        global pixel_size
-        pixel_size = coord2 - coord1
+            if ratio is not None and max(ratio[:2]) > image_raw.count:
+                QMessageBox.warning(self, 'Band Ratio',
+                                    'The image only has ' + str(image_raw.count) + ' bands, '
+                                    'band ratio masking is disabled.')
+                ratio = None
 
-        self.loadImageLabel.setText('Image Data Loaded')
+            self.predict_config = self.predict_config._replace(
+                memory_budget=memory_budget,
+                mask_loc=mask_loc,
+                water_ratio=ratio
+            )
+
+            self.loadImageLabel.setText('Image Data Loaded')
+
+        self.loadImageLabel.setText('Loading Image...')
+        self.startWorker(lambda worker: self.pipeline.load_image(img_loc), imageLoaded)
 
 
     def loadSampleDialog(self):
@@ -344,6 +577,14 @@ class SDBWidget(QWidget):
         self.showCheckBox.toggled.connect(self.showCheckBoxState)
         self.showState = QLabel()
 
+        self.streamCheckBox = QCheckBox('Stream From Disk, Rows per Chunk:')
+        self.streamCheckBox.setChecked(False)
+        self.chunkSizeSB = QSpinBox()
+        self.chunkSizeSB.setRange(1000, 10000000)
+        self.chunkSizeSB.setSingleStep(10000)
+        self.chunkSizeSB.setValue(100000)
+        self.chunkSizeSB.setAlignment(Qt.AlignRight)
+
         cancelButton = QPushButton('Cancel')
         cancelButton.clicked.connect(loadSample.close)
         loadButton = QPushButton('Load')
@@ -368,9 +609,12 @@ class SDBWidget(QWidget):
 
         grid.addWidget(self.locList, 5, 1, 10, 4)
 
-        grid.addWidget(self.showCheckBox, 15, 1, 1, 2)
-        grid.addWidget(loadButton, 15, 3, 1, 1)
-        grid.addWidget(cancelButton, 15, 4, 1, 1)
+        grid.addWidget(self.streamCheckBox, 15, 1, 1, 2)
+        grid.addWidget(self.chunkSizeSB, 15, 3, 1, 1)
+
+        grid.addWidget(self.showCheckBox, 16, 1, 1, 2)
+        grid.addWidget(loadButton, 16, 3, 1, 1)
+        grid.addWidget(cancelButton, 16, 4, 1, 1)
 
         loadSample.setLayout(grid)
 
@@ -384,13 +628,11 @@ class SDBWidget(QWidget):
         selectedFilter = 'Comma Separated Value (*.csv)'
         fname = QFileDialog.getOpenFileNames(self, 'Open File(s)', home_dir, fileFilter, selectedFilter)
 
-        global filesList
-        filesList = fname[0]
+        self.filesList = fname[0]
 
-        global fileListPrint
         fileListPrint = ''
 
-        for file in filesList:
+        for file in self.filesList:
             fileListPrint += file + '\n'
 
         self.locList.setText(fileListPrint)
@@ -406,13 +648,11 @@ class SDBWidget(QWidget):
 
         pathName = fname + '/**/*' + textTypeSelect
 
-        global filesList
-        filesList = glob.glob(pathName, recursive=True)
+        self.filesList = glob.glob(pathName, recursive=True)
 
-        global fileListPrint
         fileListPrint = ''
 
-        for file in filesList:
+        for file in self.filesList:
             fileListPrint += file + '\n'
 
         self.locList.setText(fileListPrint)
@@ -430,60 +670,142 @@ class SDBWidget(QWidget):
 
         head = self.headerLineSB.value() - 1
         start_data = self.dataLineSB.value() - 1
-        sepDict = {'Tab': '\t', 'Comma': ',', 'Space': ' ', 'Semicolon': ';'}
-        sepSelect = sepDict[self.sepCB.currentText()]
+        sepSelect = SEPARATORS[self.sepCB.currentText()]
 
-        dummy = []
+        if self.streamCheckBox.isChecked():
+            chunk_size = self.chunkSizeSB.value()
+        else:
+            chunk_size = None
 
-        global sample_size
-        sample_size = np.ones(len(filesList))
+        return SampleConfig(tuple(self.filesList), sepSelect, head, start_data, chunk_size)
 
-        for file in filesList:
-            raw_single = pd.read_csv(file, sep=sepSelect, header=head)
-            raw_single = raw_single.iloc[start_data:, 0:]
 
-            dummy.append(raw_single)
+    def loadSampleAction(self):
 
-            sample_size[filesList.index(file)] = os.path.getsize(file)
+        sample_config = self.loadSampleDict()
+        show_all = self.showState.text() == 'checked'
+        n_workers = self.predict_config.n_workers
 
-        sample_size = sample_size.sum()
+        def loadSampleTask(worker):
 
-        global samples_raw
-        samples_raw = pd.concat(dummy, ignore_index=True, sort=False)
+            return self.pipeline.load_samples(
+                sample_config,
+                lambda done, total: worker.progress.emit(done, total, 'Reading file %v of %m'),
+                n_workers)
 
-        return samples_raw
+        def samplesLoaded(raw):
 
+            self.showSamples(raw, show_all)
 
-    def loadSampleAction(self):
+            if sample_config.chunk_size is not None:
+                self.loadSampleLabel.setText('Sample Preview Loaded (Streamed)')
+
+        self.loadSampleLabel.setText('Loading Sample...')
+        self.startWorker(loadSampleTask, samplesLoaded)
+
+
+    def aggregateAction(self):
+
+        if self.pipeline.image_raw is None or self.pipeline.samples_loaded is None:
+            QMessageBox.warning(self, 'Aggregate', 'Please load the image and the samples first.')
+            return
+
+        aggregate_config = AggregateConfig(
+            self.xCB.currentText(),
+            self.yCB.currentText(),
+            self.depthHeaderCB.currentText(),
+            self.sampleCRSLine.text().strip() or None,
+            self.statisticCB.currentText(),
+            self.strideSB.value()
+        )
+        show_all = self.showState.text() == 'checked'
+        depth_label = aggregate_config.depth_label
+        band_start = self.bandStartCB.currentText()
+        band_end = self.bandEndCB.currentText()
+
+        def aggregated(raw):
+
+            # keep the chosen columns, the appended Count column is no band
+            self.showSamples(raw, show_all)
+            self.depthHeaderCB.setCurrentText(depth_label)
+            self.bandStartCB.setCurrentText(band_start)
+            self.bandEndCB.setCurrentText(band_end)
+            self.xCB.setCurrentText(aggregate_config.x_label)
+            self.yCB.setCurrentText(aggregate_config.y_label)
+            self.loadSampleLabel.setText(str(len(raw)) + ' Pixels With Samples')
 
-        raw = self.loadSampleDict()
+        self.loadSampleLabel.setText('Aggregating...')
+        self.startWorker(lambda worker: self.pipeline.aggregate(aggregate_config), aggregated)
 
-        if self.showState.text() == 'checked':
+
+    def extractAction(self):
+
+        if self.pipeline.image_raw is None or self.pipeline.samples_loaded is None:
+            QMessageBox.warning(self, 'Extract Bands', 'Please load the image and the samples first.')
+            return
+
+        feature_config = FeatureConfig(
+            self.xCB.currentText(),
+            self.yCB.currentText(),
+            self.sampleCRSLine.text().strip() or None
+        )
+        show_all = self.showState.text() == 'checked'
+        nbands = self.pipeline.image_raw.count
+
+        def extractTask(worker):
+
+            return self.pipeline.extract_features(
+                feature_config,
+                lambda done, total: worker.progress.emit(done, total, 'Reading block %v of %m'))
+
+        depth_label = self.depthHeaderCB.currentText()
+
+        def extracted(raw):
+
+            self.showSamples(raw, show_all, raw.columns.size - nbands)
+            self.depthHeaderCB.setCurrentText(depth_label)
+            self.loadSampleLabel.setText(str(len(raw)) + ' Samples on Image')
+
+        self.loadSampleLabel.setText('Extracting Bands...')
+        self.startWorker(extractTask, extracted)
+
+
+    def showSamples(self, raw, show_all, first_band=1):
+
+        if show_all:
             data = raw
         else:
             data = raw.head(100)
 
+        columns = [str(column) for column in data.columns]
+
         self.depthHeaderCB.clear()
-        self.depthHeaderCB.addItems(data.columns)
+        self.depthHeaderCB.addItems(columns)
         self.bandStartCB.clear()
-        self.bandStartCB.addItems(data.columns)
-        self.bandStartCB.setCurrentIndex(1)
+        self.bandStartCB.addItems(columns)
+        self.bandStartCB.setCurrentIndex(first_band)
         self.bandEndCB.clear()
-        self.bandEndCB.addItems(data.columns)
+        self.bandEndCB.addItems(columns)
         self.bandEndCB.setCurrentIndex(data.columns.size - 1)
 
-        self.table.setColumnCount(len(data.columns))
-        self.table.setRowCount(len(data.index))
+        # guess the coordinate columns from their headers
+        coordinates = [column.strip().lower() for column in columns]
+        self.xCB.clear()
+        self.xCB.addItems(columns)
+        self.yCB.clear()
+        self.yCB.addItems(columns)
 
-        for h in range(len(data.columns)):
-            self.table.setHorizontalHeaderItem(
-                h, QTableWidgetItem(data.columns[h]))
+        for i, column in enumerate(coordinates):
+            if column in X_HEADERS:
+                self.xCB.setCurrentIndex(i)
+                break
 
-        for i in range(len(data.index)):
-            for j in range(len(data.columns)):
-                self.table.setItem(i, j, QTableWidgetItem(str(data.iloc[i, j])))
+        for i, column in enumerate(coordinates):
+            if column in Y_HEADERS:
+                self.yCB.setCurrentIndex(i)
+                break
 
-        self.table.resizeRowsToContents()
+        self.sampleModel.setDataFrame(data)
         self.table.resizeColumnsToContents()
 
         self.loadSampleLabel.setText('Sample Data Loaded')
@@ -535,12 +857,11 @@ class SDBWidget(QWidget):
 
     def loadMLROptionAction(self):
 
-        global mlr_op_list
-        mlr_op_list = [
+        self.method_options[METHODS[0]] = MLROptions(
             self.str2bool(self.fitInterceptCB.currentText()),
             self.str2bool(self.normalizeCB.currentText()),
             self.str2bool(self.copyXCB.currentText())
-        ]
+        )
 
 
     def rfOptionDialog(self):
@@ -560,6 +881,37 @@ class SDBWidget(QWidget):
         self.criterionCB = QComboBox()
         self.criterionCB.addItems(['mse', 'mae'])
 
+        # 0 stands for the unlimited defaults
+        maxDepthLabel = QLabel('Max Depth:')
+        self.maxDepthSB = QSpinBox()
+        self.maxDepthSB.setRange(0, 1000)
+        self.maxDepthSB.setSpecialValueText('None')
+        self.maxDepthSB.setAlignment(Qt.AlignRight)
+        self.maxDepthSB.setToolTip('Shallower trees make a smaller model that predicts faster')
+
+        minSamplesLeafLabel = QLabel('Min Samples Leaf:')
+        self.minSamplesLeafSB = QSpinBox()
+        self.minSamplesLeafSB.setRange(1, 100000)
+        self.minSamplesLeafSB.setAlignment(Qt.AlignRight)
+
+        maxFeaturesLabel = QLabel('Max Features:')
+        self.maxFeaturesDSB = QDoubleSpinBox()
+        self.maxFeaturesDSB.setRange(.01, 1)
+        self.maxFeaturesDSB.setDecimals(2)
+        self.maxFeaturesDSB.setSingleStep(.1)
+        self.maxFeaturesDSB.setValue(1)
+        self.maxFeaturesDSB.setAlignment(Qt.AlignRight)
+        self.maxFeaturesDSB.setToolTip('Share of the bands tried at each split')
+
+        maxSamplesLabel = QLabel('Max Samples:')
+        self.maxSamplesDSB = QDoubleSpinBox()
+        self.maxSamplesDSB.setRange(0, 1)
+        self.maxSamplesDSB.setDecimals(2)
+        self.maxSamplesDSB.setSingleStep(.1)
+        self.maxSamplesDSB.setSpecialValueText('None')
+        self.maxSamplesDSB.setAlignment(Qt.AlignRight)
+        self.maxSamplesDSB.setToolTip('Share of the training samples drawn for each tree')
+
         cancelButton = QPushButton('Cancel')
         cancelButton.clicked.connect(optionDialog.close)
         loadButton = QPushButton('Load')
@@ -574,8 +926,20 @@ class SDBWidget(QWidget):
         grid.addWidget(criterionLabel, 2, 1, 1, 2)
         grid.addWidget(self.criterionCB, 2, 3, 1, 2)
 
-        grid.addWidget(loadButton, 3, 3, 1, 1)
-        grid.addWidget(cancelButton, 3, 4, 1, 1)
+        grid.addWidget(maxDepthLabel, 3, 1, 1, 2)
+        grid.addWidget(self.maxDepthSB, 3, 3, 1, 2)
+
+        grid.addWidget(minSamplesLeafLabel, 4, 1, 1, 2)
+        grid.addWidget(self.minSamplesLeafSB, 4, 3, 1, 2)
+
+        grid.addWidget(maxFeaturesLabel, 5, 1, 1, 2)
+        grid.addWidget(self.maxFeaturesDSB, 5, 3, 1, 2)
+
+        grid.addWidget(maxSamplesLabel, 6, 1, 1, 2)
+        grid.addWidget(self.maxSamplesDSB, 6, 3, 1, 2)
+
+        grid.addWidget(loadButton, 7, 3, 1, 1)
+        grid.addWidget(cancelButton, 7, 4, 1, 1)
 
         optionDialog.setLayout(grid)
 
@@ -584,24 +948,43 @@ class SDBWidget(QWidget):
 
     def loadRFOptionAction(self):
 
-        global rf_op_list
-        rf_op_list = [
+        self.method_options[METHODS[1]] = RFOptions(
             self.ntreeSB.value(),
-            self.criterionCB.currentText()
-        ]
+            self.criterionCB.currentText(),
+            self.maxDepthSB.value() or None,
+            self.minSamplesLeafSB.value(),
+            self.maxFeaturesDSB.value(),
+            self.maxSamplesDSB.value() or None
+        )
 
 
     def svmOptionDialog(self):
 
+        self.kernelOptionDialog(METHODS[2])
+
+
+    def approxSVMOptionDialog(self):
+
+        self.kernelOptionDialog(METHODS[4])
+
+
+    def kernelOptionDialog(self, method):
+        ''' Kernel, gamma and C of the exact or approximate SVM, plus the approximation '''
+
+        approximate = method == METHODS[4]
+
         optionDialog = QDialog()
-        optionDialog.setWindowTitle('Options (SVM)')
+        optionDialog.setWindowTitle('Options (SVM, approximate)' if approximate else 'Options (SVM)')
         optionDialog.setWindowIcon(
             QIcon(resource_path('setting-tool-pngrepo-com.png')))
 
         kernelLabel = QLabel('Kernel:')
         self.kernelCB = QComboBox()
-        self.kernelCB.addItems(['linear', 'poly', 'rbf', 'sigmoid', 'precomputed'])
-        self.kernelCB.setCurrentIndex(2)
+        if approximate:
+            self.kernelCB.addItems(['linear', 'poly', 'rbf', 'sigmoid'])
+        else:
+            self.kernelCB.addItems(['linear', 'poly', 'rbf', 'sigmoid', 'precomputed'])
+        self.kernelCB.setCurrentText('rbf')
 
         gammaLabel = QLabel('Gamma:')
         self.gammaDSB = QDoubleSpinBox()
@@ -617,10 +1000,27 @@ class SDBWidget(QWidget):
         self.cDSB.setValue(1000.0)
         self.cDSB.setAlignment(Qt.AlignRight)
 
+        componentsLabel = QLabel('Components:')
+        self.componentsSB = QSpinBox()
+        self.componentsSB.setRange(10, 100000)
+        self.componentsSB.setValue(ApproxSVMOptions().n_components)
+        self.componentsSB.setAlignment(Qt.AlignRight)
+        self.componentsSB.setToolTip('More components approximate the kernel closer, '
+                                     'but fit and predict slower')
+
+        approximationLabel = QLabel('Approximation:')
+        self.approximationCB = QComboBox()
+        self.approximationCB.addItems(['fourier', 'nystroem'])
+        self.approximationCB.setToolTip('Random Fourier features (rbf kernel only) are the '
+                                        'fastest, Nystroem works with every kernel')
+
         cancelButton = QPushButton('Cancel')
         cancelButton.clicked.connect(optionDialog.close)
         loadButton = QPushButton('Load')
-        loadButton.clicked.connect(self.loadSVMOptionAction)
+        if approximate:
+            loadButton.clicked.connect(self.loadApproxSVMOptionAction)
+        else:
+            loadButton.clicked.connect(self.loadSVMOptionAction)
         loadButton.clicked.connect(optionDialog.close)
 
         grid = QGridLayout()
@@ -634,8 +1034,15 @@ class SDBWidget(QWidget):
         grid.addWidget(cLabel, 3, 1, 1, 2)
         grid.addWidget(self.cDSB, 3, 3, 1, 2)
 
-        grid.addWidget(loadButton, 4, 3, 1, 1)
-        grid.addWidget(cancelButton, 4, 4, 1, 1)
+        if approximate:
+            grid.addWidget(componentsLabel, 4, 1, 1, 2)
+            grid.addWidget(self.componentsSB, 4, 3, 1, 2)
+
+            grid.addWidget(approximationLabel, 5, 1, 1, 2)
+            grid.addWidget(self.approximationCB, 5, 3, 1, 2)
+
+        grid.addWidget(loadButton, 6, 3, 1, 1)
+        grid.addWidget(cancelButton, 6, 4, 1, 1)
 
         optionDialog.setLayout(grid)
 
@@ -644,204 +1051,663 @@ class SDBWidget(QWidget):
 
     def loadSVMOptionAction(self):
 
-        global svm_op_list
-        svm_op_list = [
+        self.method_options[METHODS[2]] = SVMOptions(
             self.kernelCB.currentText(),
             self.gammaDSB.value(),
             self.cDSB.value()
-        ]
+        )
 
 
-    def inputDict(self):
+    def loadApproxSVMOptionAction(self):
 
-        samples_edit = samples_raw.copy()
+        if self.approximationCB.currentText() == 'fourier' and self.kernelCB.currentText() != 'rbf':
+            QMessageBox.warning(self, 'Options (SVM, approximate)',
+                                'Random Fourier features only approximate the rbf kernel, '
+                                'the nystroem approximation is used.')
+            self.approximationCB.setCurrentText('nystroem')
 
-        depth_label = self.depthHeaderCB.currentText()
-        start_label = self.bandStartCB.currentText()
-        end_label = self.bandEndCB.currentText()
+        self.method_options[METHODS[4]] = ApproxSVMOptions(
+            self.kernelCB.currentText(),
+            self.gammaDSB.value(),
+            self.cDSB.value(),
+            self.componentsSB.value(),
+            self.approximationCB.currentText()
+        )
 
-        test_data_size = (100 - self.trainPercentDSB.value()) / 100
 
-        positives_count = samples_edit[samples_edit[depth_label] > 0][depth_label].count()
-        samples_count = samples_edit[depth_label].count()
+    def incrementalOptionDialog(self):
 
-        if positives_count > samples_count / 2:
-            samples_edit[depth_label] = samples_edit[depth_label] * -1
-        else:
-            pass
+        optionDialog = QDialog()
+        optionDialog.setWindowTitle('Options (Incremental LR)')
+        optionDialog.setWindowIcon(QIcon(resource_path('setting-tool-pngrepo-com.png')))
+
+        fitInterceptLabel = QLabel('Fit Intercept:')
+        self.incFitInterceptCB = QComboBox()
+        self.incFitInterceptCB.addItems(['True', 'False'])
+
+        cancelButton = QPushButton('Cancel')
+        cancelButton.clicked.connect(optionDialog.close)
+        loadButton = QPushButton('Load')
+        loadButton.clicked.connect(self.loadIncrementalOptionAction)
+        loadButton.clicked.connect(optionDialog.close)
+
+        grid = QGridLayout()
+
+        grid.addWidget(fitInterceptLabel, 1, 1, 1, 2)
+        grid.addWidget(self.incFitInterceptCB, 1, 3, 1, 2)
+
+        grid.addWidget(loadButton, 2, 3, 1, 1)
+        grid.addWidget(cancelButton, 2, 4, 1, 1)
+
+        optionDialog.setLayout(grid)
+
+        optionDialog.exec_()
 
-        if self.limitState.text() == 'unchecked':
-            print('checking input')
-            samples_edit = samples_edit[samples_edit[depth_label] >= self.limitSB.value()]
-            samples_edit = samples_edit[samples_edit[depth_label] <= 0]
-        else:
-            pass
 
-        start_loc = samples_edit.columns.get_loc(start_label)
-        end_loc = samples_edit.columns.get_loc(end_label)
+    def loadIncrementalOptionAction(self):
 
-        features = samples_edit.iloc[:, start_loc:end_loc+1]
-        z = samples_edit[depth_label]
+        self.method_options[METHODS[3]] = IncrementalLROptions(
+            self.str2bool(self.incFitInterceptCB.currentText())
+        )
+
+
+    def hgbOptionDialog(self):
+
+        optionDialog = QDialog()
+        optionDialog.setWindowTitle('Options (Gradient Boosting)')
+        optionDialog.setWindowIcon(QIcon(resource_path('setting-tool-pngrepo-com.png')))
+
+        learningRateLabel = QLabel('Learning Rate:')
+        self.learningRateDSB = QDoubleSpinBox()
+        self.learningRateDSB.setRange(.001, 1)
+        self.learningRateDSB.setDecimals(3)
+        self.learningRateDSB.setSingleStep(.01)
+        self.learningRateDSB.setValue(HGBOptions().learning_rate)
+        self.learningRateDSB.setAlignment(Qt.AlignRight)
+
+        maxIterLabel = QLabel('Max Iterations:')
+        self.maxIterSB = QSpinBox()
+        self.maxIterSB.setRange(1, 10000)
+        self.maxIterSB.setValue(HGBOptions().max_iter)
+        self.maxIterSB.setAlignment(Qt.AlignRight)
+
+        maxLeafNodesLabel = QLabel('Max Leaf Nodes:')
+        self.maxLeafNodesSB = QSpinBox()
+        self.maxLeafNodesSB.setRange(2, 65536)
+        self.maxLeafNodesSB.setValue(HGBOptions().max_leaf_nodes)
+        self.maxLeafNodesSB.setAlignment(Qt.AlignRight)
+
+        earlyStoppingLabel = QLabel('Early Stopping:')
+        self.earlyStoppingCB = QComboBox()
+        self.earlyStoppingCB.addItems(['True', 'False'])
+        self.earlyStoppingCB.setToolTip('Hold out 10% of the training samples and stop '
+                                        'once 10 iterations in a row did not improve on them')
+
+        cancelButton = QPushButton('Cancel')
+        cancelButton.clicked.connect(optionDialog.close)
+        loadButton = QPushButton('Load')
+        loadButton.clicked.connect(self.loadHGBOptionAction)
+        loadButton.clicked.connect(optionDialog.close)
+
+        grid = QGridLayout()
 
-        features_train, features_test, z_train, z_test = train_test_split(features, z, test_size=test_data_size, random_state=0)
+        grid.addWidget(learningRateLabel, 1, 1, 1, 2)
+        grid.addWidget(self.learningRateDSB, 1, 3, 1, 2)
 
-        samples_split = [features_train, features_test, z_train, z_test]
+        grid.addWidget(maxIterLabel, 2, 1, 1, 2)
+        grid.addWidget(self.maxIterSB, 2, 3, 1, 2)
 
-        self.progressBar.setValue(1)
+        grid.addWidget(maxLeafNodesLabel, 3, 1, 1, 2)
+        grid.addWidget(self.maxLeafNodesSB, 3, 3, 1, 2)
 
-        return samples_split
+        grid.addWidget(earlyStoppingLabel, 4, 1, 1, 2)
+        grid.addWidget(self.earlyStoppingCB, 4, 3, 1, 2)
 
+        grid.addWidget(loadButton, 5, 3, 1, 1)
+        grid.addWidget(cancelButton, 5, 4, 1, 1)
 
-    def mlrPredict(self):
-        print('mlrPredict')
+        optionDialog.setLayout(grid)
 
-        samples_split = self.inputDict()
+        optionDialog.exec_()
 
-        regressor = LinearRegression(
-            fit_intercept=mlr_op_list[0],
-            normalize=mlr_op_list[1],
-            copy_X=mlr_op_list[2]
+
+    def loadHGBOptionAction(self):
+
+        self.method_options[METHODS[5]] = HGBOptions(
+            self.learningRateDSB.value(),
+            self.maxIterSB.value(),
+            self.maxLeafNodesSB.value(),
+            self.str2bool(self.earlyStoppingCB.currentText())
         )
 
-        samples_split.append(regressor)
 
-        global print_parameters_info
-        print_parameters_info = (
-            'Fit Intercept:' + '\t\t' + str(mlr_op_list[0]) + '\n' +
-            'Normalize:' + '\t\t' + str(mlr_op_list[1]) + '\n' +
-            'Copy X:' + '\t\t' + str(mlr_op_list[2])
+    def modelConfig(self):
+
+        if self.limitState.text() == 'unchecked':
+            limit = self.limitSB.value()
+        else:
+            limit = None
+
+        method = self.methodCB.currentText()
+
+        # the train percentage is the share of blocks with a spatial split
+        if self.splitCB.currentText() == 'Spatial Blocks':
+            cell_size = self.cellSizeDSB.value()
+        else:
+            cell_size = None
+
+        return ModelConfig(
+            self.depthHeaderCB.currentText(),
+            self.bandStartCB.currentText(),
+            self.bandEndCB.currentText(),
+            method,
+            self.method_options[method],
+            self.trainPercentDSB.value(),
+            limit,
+            self.xCB.currentText(),
+            self.yCB.currentText(),
+            cell_size,
+            self.foldsSB.value()
         )
 
-        return samples_split
 
+    def tuneDialog(self):
 
-    def rfPredict(self):
-        print('rfPredict')
+        method = self.methodCB.currentText()
+        options = self.method_options[method]
 
-        samples_split = self.inputDict()
+        tuneDialog = QDialog()
+        tuneDialog.setWindowTitle('Tune (' + method + ')')
+        tuneDialog.setWindowIcon(QIcon(resource_path('setting-tool-pngrepo-com.png')))
 
-        regressor = RandomForestRegressor(
-            n_estimators=rf_op_list[0],
-            criterion=rf_op_list[1],
-            random_state=0)
+        spaceLabel = QLabel('Values to try, separated by commas:')
 
-        samples_split.append(regressor)
+        self.spaceLines = {}
+        for name, value in options._asdict().items():
+            self.spaceLines[name] = QLineEdit(str(value))
 
-        global print_parameters_info
-        print_parameters_info = (
-            'N Trees:' + '\t\t' + str(rf_op_list[0]) + '\n' +
-            'Criterion:' + '\t\t' + str(rf_op_list[1])
-        )
+        strategyLabel = QLabel('Search:')
+        self.strategyCB = QComboBox()
+        self.strategyCB.addItems(['grid', 'random', 'halving'])
+
+        nIterLabel = QLabel('Random Draws:')
+        self.nIterSB = QSpinBox()
+        self.nIterSB.setRange(1, 1000)
+        self.nIterSB.setValue(10)
+        self.nIterSB.setAlignment(Qt.AlignRight)
+
+        searchFoldsLabel = QLabel('CV Folds:')
+        self.searchFoldsSB = QSpinBox()
+        self.searchFoldsSB.setRange(2, 20)
+        self.searchFoldsSB.setValue(3)
+        self.searchFoldsSB.setAlignment(Qt.AlignRight)
+
+        cancelButton = QPushButton('Cancel')
+        cancelButton.clicked.connect(tuneDialog.close)
+        searchButton = QPushButton('Search')
+        searchButton.clicked.connect(self.tuneAction)
+        searchButton.clicked.connect(tuneDialog.close)
+
+        grid = QGridLayout()
+
+        grid.addWidget(spaceLabel, 1, 1, 1, 4)
+
+        for row, (name, line) in enumerate(self.spaceLines.items(), 2):
+            grid.addWidget(QLabel(name + ':'), row, 1, 1, 2)
+            grid.addWidget(line, row, 3, 1, 2)
+
+        row = len(self.spaceLines) + 2
+
+        grid.addWidget(strategyLabel, row, 1, 1, 1)
+        grid.addWidget(self.strategyCB, row, 2, 1, 1)
+        grid.addWidget(nIterLabel, row, 3, 1, 1)
+        grid.addWidget(self.nIterSB, row, 4, 1, 1)
+
+        grid.addWidget(searchFoldsLabel, row + 1, 1, 1, 1)
+        grid.addWidget(self.searchFoldsSB, row + 1, 2, 1, 1)
+        grid.addWidget(searchButton, row + 1, 3, 1, 1)
+        grid.addWidget(cancelButton, row + 1, 4, 1, 1)
+
+        tuneDialog.setLayout(grid)
+
+        tuneDialog.exec_()
+
+
+    def optionParser(self, option_type):
+        ''' Text to option value for an option annotation, 'None' allowed for Optional '''
+
+        if option_type is bool:
+            def parse_bool(text):
+                if text not in ('True', 'False'):
+                    raise ValueError(text)
+
+                return self.str2bool(text)
+
+            return parse_bool
 
-        return samples_split
+        if getattr(option_type, '__origin__', None) is Union:
+            value_type = next(arg for arg in option_type.__args__ if arg is not type(None))
 
+            return lambda text: None if text == 'None' else value_type(text)
 
-    def svmPredict(self):
-        print('svmPredict')
+        return option_type
 
-        samples_split = self.inputDict()
 
-        regressor = SVR(
-            kernel=svm_op_list[0],
-            gamma=svm_op_list[1],
-            C=svm_op_list[2],
-            cache_size=8000)
+    def tuneAction(self):
 
-        samples_split.append(regressor)
+        model_config = self.modelConfig()
+        method = model_config.method
+        option_types = METHOD_OPTIONS[method].__annotations__
 
-        global print_parameters_info
-        print_parameters_info = (
-            'Kernel:' + '\t\t' + str(svm_op_list[0]) +'\n' +
-            'Gamma:' + '\t\t' + str(svm_op_list[1]) + '\n' +
-            'C:' + '\t\t' + str(svm_op_list[2])
+        space = {}
+        for name, line in self.spaceLines.items():
+            parse = self.optionParser(option_types[name])
+
+            values = []
+            for value in line.text().split(','):
+                if not value.strip():
+                    continue
+
+                try:
+                    values.append(parse(value.strip()))
+                except ValueError:
+                    QMessageBox.critical(self, 'Tune', value.strip() + ' is not a valid value of ' +
+                                         name + '.')
+                    return
+
+            space[name] = values or [getattr(model_config.options, name)]
+
+        search_config = SearchConfig(
+            space,
+            self.strategyCB.currentText(),
+            self.nIterSB.value(),
+            self.searchFoldsSB.value()
         )
+        n_workers = self.predict_config.n_workers
+
+        def tuneTask(worker):
+
+            self.pipeline.split(model_config)
+            worker.step.emit(1, '')
+
+            return self.pipeline.tune(
+                search_config,
+                lambda done, total: worker.progress.emit(done, total, 'Fit %v of %m cross validated'),
+                n_workers)
+
+        def tuned(result):
+
+            leaderboard, best = result
+            self.method_options[method] = best
+
+            self.progressBar.setFormat('Step %v of %m completed')
+            self.progressBar.setMaximum(4)
+            self.progressBar.setValue(4)
+
+            self.resultText.setText(
+                'Best Options:' + '\t\t' + str(best) + '\n' +
+                'Tune Runtime:' + '\t\t' + str(self.pipeline.timings['Tune']) + '\n\n' +
+                'The best options are loaded, use Make Prediction to predict the image.'
+            )
+            self.leaderboardDialog(leaderboard, method)
+
+        self.resultText.setText('Tuning...\n')
+        self.startWorker(tuneTask, tuned)
+
+
+    def leaderboardDialog(self, leaderboard, method):
+
+        boardDialog = QDialog()
+        boardDialog.setWindowTitle('Leaderboard (' + method + ')')
+        boardDialog.setWindowIcon(QIcon(resource_path('setting-tool-pngrepo-com.png')))
+        boardDialog.resize(640, 360)
+
+        self.leaderboardModel = DataFrameModel()
+        self.leaderboardModel.setDataFrame(leaderboard)
+        boardTable = QTableView()
+        boardTable.setModel(self.leaderboardModel)
+        boardTable.resizeColumnsToContents()
+
+        closeButton = QPushButton('Close')
+        closeButton.clicked.connect(boardDialog.close)
+
+        grid = QGridLayout()
+        grid.addWidget(boardTable, 1, 1, 1, 4)
+        grid.addWidget(closeButton, 2, 4, 1, 1)
+
+        boardDialog.setLayout(grid)
+
+        boardDialog.exec_()
+
+
+    def saveModelAction(self):
+
+        if self.pipeline.regressor is None or self.pipeline.model_loc is not None:
+            QMessageBox.warning(self, 'Save Model', 'Please make a prediction with a new model first.')
+            return
+
+        home_dir = str(Path.home())
+        fname = QFileDialog.getSaveFileName(self, 'Save Model', home_dir, 'SDB Model (*.joblib)')
+        model_loc = fname[0]
+
+        if not model_loc:
+            return
+
+        self.startWorker(lambda worker: self.pipeline.save_model(model_loc),
+                         lambda loc: self.resultText.append('Model saved to ' + loc + '\n'))
+
+
+    def loadModelAction(self):
+
+        home_dir = str(Path.home())
+        fileFilter = 'All Files (*.*) ;; SDB Model (*.joblib)'
+        selectedFilter = 'SDB Model (*.joblib)'
+        fname = QFileDialog.getOpenFileName(self, 'Load Model', home_dir, fileFilter, selectedFilter)
+        model_loc = fname[0]
+
+        if not model_loc:
+            return
+
+        def modelLoaded(artifact):
+
+            self.useModelCheckBox.setEnabled(True)
+            self.useModelCheckBox.setChecked(True)
+            self.resultText.setText(
+                'Model:' + '\t\t' + model_loc + '\n' +
+                'Method:' + '\t\t' + artifact['method'] + '\n' +
+                'Features:' + '\t\t' + ', '.join(str(label) for label in artifact['features']) + '\n\n' +
+                'Load an image and use Make Prediction to apply it.'
+            )
+
+        self.startWorker(lambda worker: self.pipeline.load_model(model_loc), modelLoaded)
+
+
+    def predictModel(self):
+
+        predict_config = self.predict_config
+
+        def predictModelTask(worker):
+
+            worker.step.emit(2, 'Predicting...\n')
+            info = self.pipeline.run_model(
+                predict_config,
+                lambda done, total: worker.progress.emit(done, total, 'Predicting tile %v of %m'))
+            worker.step.emit(4, '')
+
+            return info
+
+        self.resultText.setText('Predicting with ' + self.pipeline.model_loc + '\n')
+        self.startWorker(predictModelTask, self.resultText.setText)
+
+
+    def batchPredictDialog(self):
+
+        if self.pipeline.regressor is None:
+            QMessageBox.warning(self, 'Batch Predict', 'Please make a prediction or load a model first.')
+            return
+
+        batchDialog = QDialog()
+        batchDialog.setWindowTitle('Batch Predict')
+        batchDialog.setWindowIcon(QIcon(resource_path('load-pngrepo-com.png')))
+
+        openFilesButton = QPushButton('Open Images')
+        openFilesButton.clicked.connect(self.batchFilesDialog)
+        openFolderButton = QPushButton('Open Folder')
+        openFolderButton.clicked.connect(self.batchFolderDialog)
+
+        locLabel = QLabel('Images:')
+        self.batchList = QTextBrowser()
+        self.batchFiles = []
+
+        outputButton = QPushButton('Output Folder')
+        outputButton.clicked.connect(self.batchOutputDialog)
+        self.batchOutputLabel = QLabel()
+
+        formatLabel = QLabel('Format:')
+        self.batchFormatCB = QComboBox()
+        self.batchFormatCB.addItems(list(FORMATS))
+
+        cancelButton = QPushButton('Cancel')
+        cancelButton.clicked.connect(batchDialog.close)
+        runButton = QPushButton('Predict')
+        runButton.clicked.connect(self.batchPredictAction)
+        runButton.clicked.connect(batchDialog.close)
+
+        grid = QGridLayout()
+        grid.addWidget(openFilesButton, 1, 1, 1, 2)
+        grid.addWidget(openFolderButton, 1, 3, 1, 2)
+
+        grid.addWidget(locLabel, 2, 1, 1, 1)
+        grid.addWidget(self.batchList, 3, 1, 10, 4)
+
+        grid.addWidget(outputButton, 13, 1, 1, 1)
+        grid.addWidget(self.batchOutputLabel, 13, 2, 1, 3)
+
+        grid.addWidget(formatLabel, 14, 1, 1, 1)
+        grid.addWidget(self.batchFormatCB, 14, 2, 1, 3)
+
+        self.outputOptions(grid, 15)
+
+        grid.addWidget(runButton, 17, 3, 1, 1)
+        grid.addWidget(cancelButton, 17, 4, 1, 1)
+
+        batchDialog.setLayout(grid)
+
+        batchDialog.exec_()
+
 
-        return samples_split
+    def batchFilesDialog(self):
+
+        home_dir = str(Path.home())
+        fileFilter = 'All Files (*.*) ;; GeoTIFF (*.tif)'
+        selectedFilter = 'GeoTIFF (*.tif)'
+        fname = QFileDialog.getOpenFileNames(self, 'Open Images', home_dir, fileFilter, selectedFilter)
+
+        self.batchFiles = fname[0]
+        self.batchList.setText(''.join(file + '\n' for file in self.batchFiles))
+
+
+    def batchFolderDialog(self):
+
+        home_dir = str(Path.home())
+        fname = QFileDialog.getExistingDirectory(self, 'Open Folder', home_dir)
+
+        self.batchFiles = sorted(glob.glob(fname + '/**/*.[Tt][Ii][Ff]', recursive=True))
+        self.batchList.setText(''.join(file + '\n' for file in self.batchFiles))
+
+
+    def batchOutputDialog(self):
+
+        home_dir = str(Path.home())
+        fname = QFileDialog.getExistingDirectory(self, 'Output Folder', home_dir)
+
+        self.batchOutputLabel.setText(fname)
+
+
+    def batchPredictAction(self):
+
+        output_dir = self.batchOutputLabel.text()
+
+        if not self.batchFiles or not output_dir:
+            QMessageBox.warning(self, 'Batch Predict', 'Please choose the images and an output folder.')
+            return
+
+        try:
+            output_config = self.loadOutputOptions()
+        except ValueError:
+            QMessageBox.critical(self, 'Batch Predict', 'No Data must be a number.')
+            return
+
+        data_type = self.batchFormatCB.currentText()
+        driver = FORMATS[data_type]
+        extension = data_type.split('*')[1].rstrip(')')
+
+        scenes = [
+            (image, os.path.join(output_dir, Path(image).stem + '_sdb' + extension))
+            for image in self.batchFiles
+        ]
+        predict_config = self.predict_config
+
+        def batchTask(worker):
+
+            worker.step.emit(2, 'Predicting ' + str(len(scenes)) + ' images...\n')
+            self.pipeline.predict_scenes(
+                scenes,
+                predict_config,
+                driver,
+                lambda done, total: worker.progress.emit(done, total, 'Predicting tile %v of %m'),
+                output_config=output_config)
+            worker.step.emit(4, '')
+
+            return self.pipeline.scenes_info()
+
+        self.resultText.setText('Batch Prediction\n')
+        self.startWorker(batchTask, self.resultText.setText)
 
 
     def predict(self):
         print('prediction')
 
-        self.resultText.setText('Fitting...\n')
-        time_start = datetime.datetime.now()
+        if self.useModelCheckBox.isChecked() and self.pipeline.model_artifact is not None:
+            return self.predictModel()
 
-        if self.methodCB.currentText() == method_list[0]:
-            regressor = self.mlrPredict()
-        elif self.methodCB.currentText() == method_list[1]:
-            regressor = self.rfPredict()
+        # fitting replaces the loaded model
+        self.useModelCheckBox.setChecked(False)
+        self.useModelCheckBox.setEnabled(False)
+
+        model_config = self.modelConfig()
+        predict_config = self.predict_config
+
+        # forests and streamed samples report progress while fitting, other fits run in one call
+        if self.pipeline.streaming():
+            fit_format = 'Fitting file %v of %m'
+            fitting = 'Fitting...\n'
+        elif model_config.method == METHODS[1]:
+            fit_format = 'Grown %v of %m trees'
+            fitting = 'Fitting...\n'
         else:
-            regressor = self.svmPredict()
+            fit_format = ''
+            fitting = 'Fitting... (Cancel takes effect once the fit finished)\n'
 
-        with parallel_backend('threading', n_jobs=njobs):
+        def predictTask(worker):
 
-            regressor[4].fit(regressor[0], regressor[2])
+            self.pipeline.split(model_config)
+            worker.step.emit(1, '')
 
-            time_fit = datetime.datetime.now()
-            self.resultText.append('Predicting...\n')
-            self.progressBar.setValue(2)
+            self.pipeline.fit(
+                predict_config.n_workers,
+                lambda done, total: worker.progress.emit(done, total, fit_format))
+            worker.step.emit(2, 'Predicting...\n')
 
-            global z_predict
-            z_predict = regressor[4].predict(bands_array)
+            self.pipeline.predict(
+                predict_config,
+                lambda done, total: worker.progress.emit(done, total, 'Predicting tile %v of %m'))
+            worker.step.emit(3, 'Calculating RMSE, MAE, and R\u00B2...\n')
 
-            if self.limitState.text() == 'unchecked':
-                print('checking prediction')
-                z_predict[z_predict < self.limitSB.value()] = np.nan
-                z_predict[z_predict > 0] = np.nan
+            self.pipeline.validate(
+                lambda done, total: worker.progress.emit(done, total, 'Validating file %v of %m'))
 
-                print_limit = (
-                    'Depth Limit:' + '\t\t' + str(self.limitSB.value())
-                )
-            else:
-                print_limit = (
-                    'Depth Limit:' + '\t\t' + 'Disabled'
-                )
-                pass
+            if model_config.cell_size is not None and model_config.folds > 1:
+                worker.step.emit(3, 'Cross validating spatial folds...\n')
+                self.pipeline.cross_validate(
+                    lambda done, total: worker.progress.emit(done, total, 'Fold %v of %m validated'),
+                    predict_config.n_workers)
 
-            time_predict = datetime.datetime.now()
-            self.resultText.append('Calculating RMSE, MAE, and R\u00B2...\n')
-            self.progressBar.setValue(3)
+            worker.step.emit(4, '')
 
-            z_validate = regressor[4].predict(regressor[1])
-            rmse = np.sqrt(metrics.mean_squared_error(regressor[3], z_validate))
-            mae = metrics.mean_absolute_error(regressor[3], z_validate)
-            r2 = metrics.r2_score(regressor[3], z_validate)
+            return self.pipeline.result_info()
 
-            time_test = datetime.datetime.now()
-            self.progressBar.setValue(4)
+        self.resultText.setText(fitting)
+        self.startWorker(predictTask, self.resultText.setText)
 
-        runtime = [
-            time_fit - time_start,
-            time_predict - time_fit,
-            time_test - time_predict,
-            time_test - time_start
-        ]
 
-        global print_result_info
-        print_result_info = (
-            'Image Input:' + '\t\t' + img_loc + ' (' +
-            str(round(img_size / 2**10 / 2**10, 2)) + ' MB)' + '\n' +
-            'Sample Data:' + '\t\t' + fileListPrint + ' (' +
-            str(round(sample_size / 2**10 / 2**10, 2)) + ' MB)' + '\n\n' +
-            print_limit + '\n' +
-            'Train Data:' + '\t\t' + str(self.trainPercentDSB.value()) + ' %' + '\n'
-            'Test Data:' + '\t\t' + str(100 - self.trainPercentDSB.value()) + ' %' + '\n\n'
-            'Method:' + '\t\t' + self.methodCB.currentText() + '\n' +
-            print_parameters_info + '\n\n'
-            'RMSE:' + '\t\t' + str(rmse) + '\n' +
-            'MAE:' + '\t\t' + str(mae) + '\n' +
-            'R\u00B2:' + '\t\t' + str(r2) + '\n\n' +
-            'Fitting Runtime:' + '\t\t' + str(runtime[0]) + '\n' +
-            'Prediction Runtime:' + '\t' + str(runtime[1]) + '\n' +
-            'Validating Runtime:' + '\t' + str(runtime[2]) + '\n' +
-            'Overall Runtime:' + '\t' + str(runtime[3]) + '\n\n' +
-            'CRS:' + '\t\t' + str(image_raw.crs) +'\n'
-            'Dimensions:' + '\t\t' + str(image_raw.width) + ' x ' + 
-            str(image_raw.height) + ' pixels' + '\n'
-            'Pixel Size:' + '\t\t' + str(pixel_size[0]) + ' , ' + 
-            str(pixel_size[1]) + '\n\n'
-        )
+    def startWorker(self, task, onResult):
+        '''Run task(worker) in a Worker thread, onResult gets its return value'''
+
+        if self.worker is not None and self.worker.isRunning():
+            QMessageBox.information(self, 'Busy', 'Please wait for the running task or cancel it.')
+            return
+
+        self.pipeline.cancelled.clear()
+
+        self.worker = Worker(task)
+        self.worker.step.connect(self.workerStep)
+        self.worker.progress.connect(self.workerProgress)
+        self.worker.result.connect(onResult)
+        self.worker.error.connect(self.workerError)
+        self.worker.finished.connect(self.workerFinished)
+
+        self.progressBar.setFormat('Step %v of %m completed')
+        self.progressBar.setMaximum(4)
+        self.progressBar.setValue(0)
+
+        self.setBusy(True)
+        self.worker.start()
+
+
+    def workerFinished(self):
+
+        self.setBusy(False)
+
+        # a close requested while the task ran waited for it to stop
+        if self.closing:
+            # finished is emitted right before the thread ends, this wait is short
+            self.worker.wait()
+            self.close()
 
-        self.resultText.setText(print_result_info)
+
+    def setBusy(self, busy):
+
+        for button in [self.loadImageButton, self.loadSampleButton, self.aggregateButton,
+                       self.extractButton, self.tuneButton, self.makePredictionButton,
+                       self.batchPredictButton, self.saveFileButton, self.saveModelButton,
+                       self.loadModelButton]:
+            button.setEnabled(not busy)
+
+        self.cancelButton.setEnabled(busy)
+
+
+    def workerStep(self, value, text):
+
+        self.progressBar.setFormat('Step %v of %m completed')
+        self.progressBar.setMaximum(4)
+        self.progressBar.setValue(value)
+
+        if text:
+            self.resultText.append(text)
+
+
+    def workerProgress(self, done, total, progress_format):
+
+        self.progressBar.setFormat(progress_format)
+        self.progressBar.setMaximum(total)
+        self.progressBar.setValue(done)
+
+
+    def workerError(self, message):
+
+        self.progressBar.setFormat('Step %v of %m completed')
+        self.progressBar.setMaximum(4)
+        self.progressBar.setValue(0)
+
+        if message == 'Cancelled':
+            self.resultText.append('Cancelled\n')
+        else:
+            QMessageBox.critical(self, 'Error', message)
+
+
+    def closeEvent(self, event):
+
+        if self.worker is not None and self.worker.isRunning():
+            # the task stops at its next cancellation point, the window closes once it did
+            self.pipeline.cancel()
+            self.closing = True
+            self.hide()
+            event.ignore()
+            return
+
+        self.pipeline.close()
+        event.accept()
 
 
     def saveOptionDialog(self):
@@ -853,14 +1719,7 @@ class SDBWidget(QWidget):
         saveFileButton = QPushButton('Save File Location')
         saveFileButton.clicked.connect(self.savePathDialog)
 
-        global format_dict
-        format_dict = {
-            'GeoTIFF (*.tif)': 'GTiff',
-            'Erdas Imagine image (*.img)': 'HFA',
-            'ASCII Gridded XYZ (*.xyz)': 'XYZ'
-        }
-
-        format_list = list(format_dict)
+        format_list = list(FORMATS)
         format_list.sort()
 
         dataTypeLabel = QLabel('Data Type:')
@@ -891,15 +1750,66 @@ class SDBWidget(QWidget):
         grid.addWidget(locLabel, 3, 1, 1, 4)
         grid.addWidget(self.locList, 4, 1, 1, 4)
 
-        grid.addWidget(self.reportCheckBox, 5, 1, 1, 2)
-        grid.addWidget(saveButton, 5, 3, 1, 1)
-        grid.addWidget(cancelButton, 5, 4, 1, 1)
+        self.outputOptions(grid, 5)
+
+        grid.addWidget(self.reportCheckBox, 8, 1, 1, 2)
+        grid.addWidget(saveButton, 8, 3, 1, 1)
+        grid.addWidget(cancelButton, 8, 4, 1, 1)
 
         saveOption.setLayout(grid)
 
         saveOption.exec_()
 
 
+    def outputOptions(self, grid, row):
+        """ Output encoding widgets on three rows of grid, starting at row """
+
+        depthTypeLabel = QLabel('Depth Type:')
+        self.depthTypeCB = QComboBox()
+        self.depthTypeCB.addItems(DEPTH_TYPES)
+        self.depthTypeCB.setCurrentText(self.output_config.dtype)
+        self.depthTypeCB.setToolTip('int16 stores centimetres, half the float32 size')
+
+        compressLabel = QLabel('Compression:')
+        self.compressCB = QComboBox()
+        self.compressCB.addItems(COMPRESSIONS)
+        self.compressCB.setCurrentText(self.output_config.compress)
+
+        nodataLabel = QLabel('No Data:')
+        self.nodataLine = QLineEdit()
+        self.nodataLine.setPlaceholderText('default of the depth type')
+        if self.output_config.nodata is not None:
+            self.nodataLine.setText(str(self.output_config.nodata))
+
+        self.overviewsCheckBox = QCheckBox('Overviews')
+        self.overviewsCheckBox.setChecked(self.output_config.overviews)
+
+        grid.addWidget(depthTypeLabel, row, 1, 1, 1)
+        grid.addWidget(self.depthTypeCB, row, 2, 1, 1)
+        grid.addWidget(compressLabel, row, 3, 1, 1)
+        grid.addWidget(self.compressCB, row, 4, 1, 1)
+
+        grid.addWidget(nodataLabel, row + 1, 1, 1, 1)
+        grid.addWidget(self.nodataLine, row + 1, 2, 1, 1)
+        grid.addWidget(self.overviewsCheckBox, row + 1, 3, 1, 2)
+
+
+    def loadOutputOptions(self):
+
+        nodata = None
+        if self.nodataLine.text().strip():
+            nodata = float(self.nodataLine.text())
+
+        self.output_config = self.output_config._replace(
+            dtype=self.depthTypeCB.currentText(),
+            compress=self.compressCB.currentText(),
+            nodata=nodata,
+            overviews=self.overviewsCheckBox.isChecked()
+        )
+
+        return self.output_config
+
+
     def savePathDialog(self):
 
         home_dir = str(Path.home())
@@ -907,10 +1817,9 @@ class SDBWidget(QWidget):
         selectedFilter = self.dataTypeCB.currentText()
         fname = QFileDialog.getSaveFileName(self, 'Save File', home_dir, fileFilter, selectedFilter)
 
-        global save_loc
-        save_loc = fname[0]
+        self.save_loc = fname[0]
 
-        self.locList.setText(save_loc)
+        self.locList.setText(self.save_loc)
 
     def reportCheckBoxState(self):
 
@@ -922,35 +1831,18 @@ class SDBWidget(QWidget):
 
     def saveAction(self):
 
-        z_img_ar = z_predict.reshape(image_raw.height, image_raw.width)
-
-        new_img = rio.open(
-            save_loc,
-            'w',
-            driver=format_dict[self.dataTypeCB.currentText()],
-            height=image_raw.height,
-            width=image_raw.width,
-            count=1,
-            dtype=z_img_ar.dtype,
-            crs=image_raw.crs,
-            transform=image_raw.transform
-        )
-
-        new_img.write(z_img_ar, 1)
-        new_img.close()
+        save_loc = self.save_loc
+        driver = FORMATS[self.dataTypeCB.currentText()]
+        report = self.reportState.text() == 'checked'
 
-        if self.reportState.text() == 'checked':
-            report_save_loc = os.path.splitext(save_loc)[0] + '_report.txt'
-            report = open(report_save_loc, 'w')
-            new_img_size = os.path.getsize(save_loc)
+        try:
+            output_config = self.loadOutputOptions()
+        except ValueError:
+            QMessageBox.critical(self, 'Save', 'No Data must be a number.')
+            return
 
-            report.write(
-                print_result_info +
-                'Output:' + '\t\t' + save_loc + ' (' +
-                str(round(new_img_size / 2**10 / 2**10, 2)) + ' MB)'
-            )
-        else:
-            pass
+        self.startWorker(lambda worker: self.pipeline.save(save_loc, driver, report, output_config),
+                         lambda report_loc: self.resultText.append('Saved ' + save_loc + '\n'))
 
 
 
@@ -991,6 +1883,7 @@ def main():
 
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
     main()
     sys.exit(app.exec_())
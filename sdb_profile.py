@@ -0,0 +1,162 @@
+import cProfile
+import contextlib
+import datetime
+import os
+import platform
+import shutil
+import signal
+import subprocess
+import sys
+import time
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def current_rss():
+    """ Resident memory of this process now in bytes, None if unknown """
+
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_rss():
+    """ Highest resident memory of this process so far in bytes, None if unknown
+
+    It never decreases, so it shows how much memory a run needed, not
+    which stage needed it; compare current_rss at stage start and end for that.
+    """
+
+    if resource is not None:
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        # kilobytes on Linux, bytes on macOS
+        return maxrss if sys.platform == 'darwin' else maxrss * 2**10
+
+    if psutil is not None:
+        memory = psutil.Process().memory_info()
+        return getattr(memory, 'peak_wset', memory.rss)
+
+    return None
+
+
+def machine_info():
+    """ Platform, CPUs and library versions, to compare runs across hardware """
+
+    import numpy
+    import pandas
+    import rasterio
+    import sklearn
+
+    return {
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'numpy': numpy.__version__,
+        'pandas': pandas.__version__,
+        'sklearn': sklearn.__version__,
+        'rasterio': rasterio.__version__,
+        'gdal': rasterio.__gdal_version__
+    }
+
+
+class StageClock(object):
+    """ Wall and CPU clocks of a running stage, and the progress steps it made """
+
+    def __init__(self):
+
+        self.started = datetime.datetime.now()
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        self.rss = current_rss()
+        self.steps = []
+
+
+    def step(self):
+
+        self.steps.append(time.perf_counter())
+
+
+    def profile(self, name, items=None, unit=None):
+        """ Stage measures as a flat dict, ready for JSON and CSV
+
+        rate is items per wall second; step times are the intervals
+        between progress calls, e.g. one per predicted tile. CPU time
+        covers all threads of this process but not worker processes.
+        rss_start_mb and rss_end_mb are the resident memory when the
+        stage started and ended, their difference is what the stage kept;
+        process_peak_rss_mb is the peak of the whole process so far.
+        """
+
+        wall = time.perf_counter() - self.wall
+        steps = [end - start for start, end in zip([self.wall] + self.steps, self.steps)]
+        rss = current_rss()
+        peak = peak_rss()
+
+        return {
+            'stage': name,
+            'started': self.started.isoformat(),
+            'wall_s': wall,
+            'cpu_s': time.process_time() - self.cpu,
+            'rss_start_mb': None if self.rss is None else self.rss / 2**20,
+            'rss_end_mb': None if rss is None else rss / 2**20,
+            'process_peak_rss_mb': None if peak is None else peak / 2**20,
+            'items': items,
+            'unit': unit,
+            'rate_per_s': items / wall if items is not None and wall > 0 else None,
+            'steps': len(steps),
+            'step_mean_s': sum(steps) / len(steps) if steps else None,
+            'step_max_s': max(steps) if steps else None
+        }
+
+
+@contextlib.contextmanager
+def profiled(cprofile_loc=None, pyspy_loc=None):
+    """ Run the enclosed code under cProfile and/or a py-spy recording
+
+    cProfile stats are dumped to cprofile_loc (open with pstats or
+    snakeviz). py-spy must be on the PATH; it samples this process into a
+    flame graph at pyspy_loc and also sees native frames.
+    """
+
+    recorder = None
+    if pyspy_loc is not None:
+        if shutil.which('py-spy') is None:
+            raise RuntimeError('py-spy is not installed')
+
+        recorder = subprocess.Popen(
+            ['py-spy', 'record', '--pid', str(os.getpid()), '--output', pyspy_loc, '--subprocesses'])
+
+    profiler = None
+    if cprofile_loc is not None:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(cprofile_loc)
+
+        if recorder is not None:
+            # py-spy writes the recording when interrupted
+            if os.name == 'nt':
+                recorder.terminate()
+            else:
+                recorder.send_signal(signal.SIGINT)
+            recorder.wait()
@@ -0,0 +1,801 @@
+import numpy as np
+import rasterio as rio
+from rasterio.crs import CRS
+from rasterio.enums import Resampling
+from rasterio.warp import transform
+from rasterio.vrt import WarpedVRT
+from rasterio.windows import Window
+import rasterio.shutil
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import deque
+from joblib import parallel_backend
+from sklearn.ensemble import HistGradientBoostingRegressor, RandomForestRegressor
+from threadpoolctl import threadpool_limits
+import contextlib
+import gzip
+import os
+import pickle
+import queue
+import tempfile
+import threading
+
+
+# bytes of band data held in memory for one block of pixels
+DEFAULT_MEMORY_BUDGET = 256 * 2**20
+
+# compressions offered for GeoTIFF and COG outputs
+COMPRESSIONS = ('DEFLATE', 'ZSTD', 'LZW', 'NONE')
+
+# output depth types, the prediction itself is float32
+DEPTH_TYPES = ('float32', 'int16')
+
+# written in place of NaN when the output config gives no nodata value
+DEFAULT_NODATA = {'float32': -9999.0, 'int16': -32768}
+
+# drivers written as x, y, depth text points by write_points, with their separator
+POINT_DRIVERS = {'XYZ': ' ', 'CSV': ','}
+
+# pixels formatted at once by write_points, about 40 bytes of text each
+POINT_CHUNK = 2**20
+
+
+def pixel_nbytes(dataset):
+    """ Bytes needed to hold every band of a single pixel in the source dtype """
+
+    return sum(np.dtype(dtype).itemsize for dtype in dataset.dtypes)
+
+
+def pixel_windows(dataset, memory_budget=DEFAULT_MEMORY_BUDGET):
+    """ Yield windows covering the dataset, each fitting into memory_budget bytes """
+
+    block_height, block_width = dataset.block_shapes[0]
+    max_pixels = max(memory_budget // pixel_nbytes(dataset), 1)
+
+    # group whole rows of native blocks into full width strips when they fit
+    strip_rows = max_pixels // dataset.width
+    if strip_rows >= block_height:
+        strip_rows -= strip_rows % block_height
+
+        for row_off in range(0, dataset.height, strip_rows):
+            yield Window(0, row_off, dataset.width, min(strip_rows, dataset.height - row_off))
+
+        return
+
+    # otherwise follow the native blocks, splitting any that are too large
+    for _, block in dataset.block_windows(1):
+        cols = min(block.width, max_pixels)
+        rows = max(max_pixels // cols, 1)
+
+        for row_off in range(0, block.height, rows):
+            for col_off in range(0, block.width, cols):
+                yield Window(
+                    block.col_off + col_off,
+                    block.row_off + row_off,
+                    min(cols, block.width - col_off),
+                    min(rows, block.height - row_off)
+                )
+
+
+def read_pixels(dataset, window):
+    """ Read a window as a (pixels, bands) feature block, keeping the source dtype """
+
+    return dataset.read(window=window).reshape(dataset.count, -1).T
+
+
+def iter_pixel_blocks(dataset, memory_budget=DEFAULT_MEMORY_BUDGET):
+    """ Lazily yield (window, features) pairs covering the whole dataset """
+
+    for window in pixel_windows(dataset, memory_budget):
+        yield window, read_pixels(dataset, window)
+
+
+def point_rowcol(dataset, xs, ys, crs=None):
+    """ Pixel rows and columns under points given in crs (the dataset CRS when None) """
+
+    xs = np.asarray(xs, dtype='float64')
+    ys = np.asarray(ys, dtype='float64')
+
+    if crs is not None and dataset.crs is not None and CRS.from_user_input(crs) != dataset.crs:
+        xs, ys = (np.asarray(v) for v in transform(crs, dataset.crs, xs, ys))
+
+    cols, rows = ~dataset.transform * (xs, ys)
+
+    with np.errstate(invalid='ignore'):
+        return np.floor(rows).astype('int64'), np.floor(cols).astype('int64')
+
+
+def sample_pixels(dataset, rows, cols, progress=None):
+    """ Band values of the pixels at rows, cols as a (points, bands) array
+
+    Points are grouped by the native block holding them and only those
+    blocks are read. Returns the values with a boolean array flagging the
+    points inside the image on valid, finite pixels.
+    """
+
+    rows = np.asarray(rows)
+    cols = np.asarray(cols)
+
+    features = np.zeros((len(rows), dataset.count), dtype=np.result_type(*dataset.dtypes))
+    inside = (rows >= 0) & (rows < dataset.height) & (cols >= 0) & (cols < dataset.width)
+    valid = np.zeros(len(rows), dtype=bool)
+
+    block_height, block_width = dataset.block_shapes[0]
+    block_cols = -(-dataset.width // block_width)
+
+    index = np.flatnonzero(inside)
+    block = rows[index] // block_height * block_cols + cols[index] // block_width
+
+    order = np.argsort(block, kind='stable')
+    index, block = index[order], block[order]
+
+    starts = np.flatnonzero(np.r_[True, block[1:] != block[:-1]]) if block.size else block
+    ends = np.r_[starts[1:], block.size]
+
+    for i, (start, end) in enumerate(zip(starts, ends)):
+        points = index[start:end]
+        block_row, block_col = divmod(int(block[start]), block_cols)
+
+        window = Window(
+            block_col * block_width,
+            block_row * block_height,
+            min(block_width, dataset.width - block_col * block_width),
+            min(block_height, dataset.height - block_row * block_height)
+        )
+        point_rows = rows[points] - window.row_off
+        point_cols = cols[points] - window.col_off
+
+        features[points] = dataset.read(window=window)[:, point_rows, point_cols].T
+        valid[points] = dataset.dataset_mask(window=window)[point_rows, point_cols] > 0
+
+        if progress is not None:
+            progress(i + 1, len(starts))
+
+    if features.dtype.kind == 'f':
+        valid &= np.isfinite(features).all(axis=1)
+
+    return features, valid
+
+
+def create_prediction(path, dataset, dtype='float32'):
+    """ Open a compressed single band GeoTIFF on the grid of dataset for block-wise writing
+
+    This is scratch space until write_output encodes the final output, so
+    it is float32 with fast DEFLATE. Its blocks follow the blocks of
+    dataset, which pixel_windows reads, so each compressed block is
+    written once.
+    """
+
+    block_height, block_width = dataset.block_shapes[0]
+
+    if block_width < dataset.width and block_height % 16 == 0 and block_width % 16 == 0:
+        layout = {'tiled': True, 'blockxsize': block_width, 'blockysize': block_height}
+    else:
+        layout = {'tiled': False, 'blockysize': block_height}
+
+    return rio.open(
+        path,
+        'w',
+        driver='GTiff',
+        height=dataset.height,
+        width=dataset.width,
+        count=1,
+        dtype=dtype,
+        crs=dataset.crs,
+        transform=dataset.transform,
+        compress='DEFLATE',
+        predictor=3,
+        zlevel=1,
+        num_threads='ALL_CPUS',
+        BIGTIFF='IF_SAFER',
+        **layout
+    )
+
+
+def encode_depth(z, dtype, nodata, scale):
+    """ Convert a NaN masked depth block into the output dtype
+
+    Integer outputs store round(z / scale), clipped so valid depths never
+    reach the nodata value.
+    """
+
+    missing = np.isnan(z)
+
+    if np.dtype(dtype).kind == 'i':
+        info = np.iinfo(dtype)
+        low = info.min + 1 if nodata == info.min else info.min
+        z = np.clip(np.round(np.nan_to_num(z).astype('float64') / scale), low, info.max)
+
+    z = z.astype(dtype)
+    z[missing] = nodata
+
+    return z
+
+
+def overview_factors(height, width, blocksize):
+    """ Decimation factors halving the raster until it fits a single block """
+
+    factors = []
+    factor = 2
+    while max(height, width) / (factor // 2) > blocksize:
+        factors.append(factor)
+        factor *= 2
+
+    return factors
+
+
+def fixed_digits(values, decimals):
+    """ Text of values with a fixed number of decimals as a (width, values) byte matrix
+
+    Numbers are right aligned, the unused leading bytes are 0.
+    """
+
+    scaled = np.round(values * 10.0**decimals).astype('int64')
+    negative = scaled < 0
+    scaled = np.abs(scaled)
+
+    width = max(len(str(scaled.max())) if len(scaled) else 1, decimals + 1)
+    powers = 10 ** np.arange(width, dtype='int64')
+    used = np.maximum(np.searchsorted(powers, scaled, side='right'), decimals + 1)
+
+    # one contiguous row per digit position, the loop only runs width times
+    digits = np.empty((width, len(scaled)), dtype='uint8')
+    rest = scaled
+    for i in range(width - 1, -1, -1):
+        rest, digits[i] = np.divmod(rest, 10)
+
+    digits += ord('0')
+    # blank the leading zeros, one stays before the decimal point
+    digits[np.arange(width)[:, None] < width - used] = 0
+
+    sign = np.where(negative, ord('-'), 0).astype('uint8')[None]
+    if not decimals:
+        return np.vstack([sign, digits])
+
+    point = np.full((1, len(scaled)), ord('.'), dtype='uint8')
+
+    return np.vstack([sign, digits[:width - decimals], point, digits[width - decimals:]])
+
+
+def fixed_text(columns, decimals, sep=' '):
+    """ Lines of columns joined by sep as bytes, formatted without a Python loop per value """
+
+    rows = len(columns[0])
+    separator = np.full((1, rows), ord(sep), dtype='uint8')
+
+    parts = []
+    for values, places in zip(columns, decimals):
+        parts += [fixed_digits(values, places), separator]
+
+    parts[-1] = np.full((1, rows), ord('\n'), dtype='uint8')
+    text = np.vstack(parts).T.ravel()
+
+    return text[text != 0].tobytes()
+
+
+def write_points(prediction_loc, save_loc, sep=' ', header=None, decimals=3):
+    """ Write the predicted pixels as x, y, depth text lines, skipping NaN
+
+    Pixel centre coordinates come from the affine transform for a strip
+    of rows at a time; geographic coordinates get 8 decimals. A .gz
+    save_loc is gzip compressed. Formatting overlaps with writing in a
+    background thread. Returns the number of points written.
+    """
+
+    with rio.open(prediction_loc) as prediction:
+        affine = prediction.transform
+        xy_decimals = 8 if prediction.crs is not None and prediction.crs.is_geographic else decimals
+        strip_rows = max(POINT_CHUNK // prediction.width, 1)
+
+        if save_loc.endswith('.gz'):
+            # level 1, higher levels make compression the bottleneck
+            output = gzip.open(save_loc, 'wb', compresslevel=1)
+        else:
+            output = open(save_loc, 'wb', buffering=2**24)
+
+        npoints = 0
+        with output, ThreadPoolExecutor(max_workers=1) as writer:
+            written = writer.submit(output.write, header.encode() if header else b'')
+
+            for row_off in range(0, prediction.height, strip_rows):
+                window = Window(0, row_off, prediction.width,
+                                min(strip_rows, prediction.height - row_off))
+                z = prediction.read(1, window=window)
+
+                rows, cols = np.nonzero(~np.isnan(z))
+                rows = rows + (row_off + 0.5)
+                cols = cols + 0.5
+
+                xs = affine.a * cols + affine.b * rows + affine.c
+                ys = affine.d * cols + affine.e * rows + affine.f
+                text = fixed_text((xs, ys, z[~np.isnan(z)]), (xy_decimals, xy_decimals, decimals), sep)
+
+                written.result()
+                written = writer.submit(output.write, text)
+                npoints += len(xs)
+
+            written.result()
+
+    return npoints
+
+
+def write_output(prediction_loc, save_loc, driver='GTiff', dtype='float32', nodata=None,
+                 scale=0.01, compress='DEFLATE', overviews=True, blocksize=512):
+    """ Encode a float32 prediction from create_prediction into its final output
+
+    GeoTIFF and COG outputs are tiled and compressed with a predictor and
+    get average overviews; the COG driver lays these out from a
+    temporary GeoTIFF. XYZ and CSV outputs are the valid pixels as text
+    points. Other drivers are copied from a plain temporary GeoTIFF of
+    the same dtype and nodata.
+    """
+
+    if driver in POINT_DRIVERS:
+        header = 'x,y,depth\n' if driver == 'CSV' else None
+        write_points(prediction_loc, save_loc, POINT_DRIVERS[driver], header)
+        return
+
+    if dtype not in DEPTH_TYPES:
+        raise ValueError('depth type ' + str(dtype) + ' is not one of ' + ', '.join(DEPTH_TYPES))
+
+    if nodata is None:
+        nodata = DEFAULT_NODATA[dtype]
+
+    integer = np.dtype(dtype).kind == 'i'
+    tiff = driver in ('GTiff', 'COG')
+
+    target_loc = save_loc
+    if driver != 'GTiff':
+        target_fd, target_loc = tempfile.mkstemp(prefix='sdb_', suffix='.tif')
+        os.close(target_fd)
+
+    try:
+        with rio.open(prediction_loc) as prediction:
+            profile = {
+                'driver': 'GTiff',
+                'height': prediction.height,
+                'width': prediction.width,
+                'count': 1,
+                'dtype': dtype,
+                'nodata': nodata,
+                'crs': prediction.crs,
+                'transform': prediction.transform,
+                'tiled': True,
+                'blockxsize': blocksize,
+                'blockysize': blocksize,
+                'BIGTIFF': 'IF_SAFER'
+            }
+
+            if tiff and compress != 'NONE':
+                profile.update(compress=compress, predictor=2 if integer else 3)
+
+            with rio.open(target_loc, 'w', **profile) as output:
+                # whole output blocks, so no compressed tile is written twice
+                for _, window in output.block_windows(1):
+                    z = prediction.read(1, window=window)
+                    output.write(encode_depth(z, dtype, nodata, scale), 1, window=window)
+
+                if integer:
+                    output.scales = (scale,)
+                    output.offsets = (0.0,)
+
+                if tiff and overviews:
+                    factors = overview_factors(output.height, output.width, blocksize)
+                    if factors:
+                        output.build_overviews(factors, Resampling.average)
+                        output.update_tags(ns='rio_overview', resampling='average')
+
+        if driver == 'COG':
+            options = {'BLOCKSIZE': blocksize, 'COMPRESS': compress,
+                       'OVERVIEWS': 'AUTO' if overviews else 'NONE', 'BIGTIFF': 'IF_SAFER'}
+            if compress != 'NONE':
+                options['PREDICTOR'] = 'YES'
+
+            rasterio.shutil.copy(target_loc, save_loc, driver=driver, **options)
+        elif driver != 'GTiff':
+            rasterio.shutil.copy(target_loc, save_loc, driver=driver)
+    finally:
+        if driver != 'GTiff' and os.path.exists(target_loc):
+            os.remove(target_loc)
+
+
+def mask_depth(z, limit):
+    """ Replace depths beyond limit or above the water surface with NaN """
+
+    z[z < limit] = np.nan
+    z[z > 0] = np.nan
+
+    return z
+
+
+def resolve_workers(n_workers):
+    """ Turn a joblib style worker count (-1 for all cores) into a positive number """
+
+    if n_workers < 0:
+        n_workers = os.cpu_count() + 1 + n_workers
+
+    return max(n_workers, 1)
+
+
+@contextlib.contextmanager
+def open_mask(path, dataset):
+    """ Open a land/cloud mask raster resampled onto the grid of dataset, None without path
+
+    The mask file and its warped view are closed when the context exits.
+    """
+
+    if path is None:
+        yield None
+        return
+
+    with rio.open(path) as source, WarpedVRT(
+            source,
+            crs=dataset.crs,
+            transform=dataset.transform,
+            width=dataset.width,
+            height=dataset.height,
+            resampling=Resampling.nearest) as mask:
+        yield mask
+
+
+def valid_pixels(dataset, window, features, mask=None, water_ratio=None):
+    """ Boolean array flagging the pixels of a feature block that should be predicted
+
+    Pixels are dropped when they are nodata, not finite, nonzero in the
+    mask raster, or when the normalized difference of the water_ratio
+    bands (first band, second band, threshold) is not above the threshold.
+    """
+
+    valid = dataset.dataset_mask(window=window).ravel() > 0
+
+    if features.dtype.kind == 'f':
+        valid &= np.isfinite(features).all(axis=1)
+
+    if mask is not None:
+        valid &= mask.read(1, window=window).ravel() == 0
+
+    if water_ratio is not None:
+        band_a = features[:, water_ratio[0] - 1].astype('float32')
+        band_b = features[:, water_ratio[1] - 1].astype('float32')
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            valid &= (band_a - band_b) / (band_a + band_b) > water_ratio[2]
+
+    return valid
+
+
+def inference_dtype(regressor):
+    """ Feature dtype the regressor predicts from without converting, None for any """
+
+    # tree thresholds are float32, sklearn copies everything else into C ordered float32
+    if isinstance(regressor, RandomForestRegressor):
+        return np.float32
+
+    return None
+
+
+def native_parallel(regressor):
+    """ Whether the regressor predicts on several cores itself, with the GIL released """
+
+    # forest trees run in joblib threads, gradient boosting in OpenMP
+    return isinstance(regressor, (RandomForestRegressor, HistGradientBoostingRegressor))
+
+
+def predict_features(regressor, features, valid, limit=None):
+    """ Predict the depth of the valid rows of a feature block, NaN elsewhere """
+
+    index = np.flatnonzero(valid)
+
+    z = np.full(len(features), np.nan)
+
+    if index.size:
+        features = features if index.size == len(features) else features[index]
+
+        dtype = inference_dtype(regressor)
+        if dtype is not None:
+            features = np.ascontiguousarray(features, dtype=dtype)
+
+        z[index] = regressor.predict(features)
+
+    if limit is not None:
+        mask_depth(z, limit)
+
+    return z, index.size
+
+
+def predict_window(regressor, dataset, window, limit=None, mask=None, water_ratio=None):
+    """ Predict the depth of the valid pixels inside window, NaN elsewhere """
+
+    features = read_pixels(dataset, window)
+    valid = valid_pixels(dataset, window, features, mask, water_ratio)
+
+    return predict_features(regressor, features, valid, limit)
+
+
+# state of a prediction worker process, filled once by init_worker
+_worker = {}
+
+
+def init_predictor(regressor_pickle):
+
+    # one tile per process, natively threaded regressors would oversubscribe the cores
+    threadpool_limits(1)
+
+    _worker['regressor'] = pickle.loads(regressor_pickle)
+
+
+def init_worker(regressor_pickle, path, mask_path):
+
+    init_predictor(regressor_pickle)
+
+    # open for the life of the worker process
+    stack = contextlib.ExitStack()
+
+    _worker['dataset'] = stack.enter_context(rio.open(path))
+    _worker['mask'] = stack.enter_context(open_mask(mask_path, _worker['dataset']))
+    _worker['stack'] = stack
+
+
+def predict_worker(window, limit, water_ratio):
+
+    return predict_window(_worker['regressor'], _worker['dataset'], window, limit,
+                          _worker['mask'], water_ratio)
+
+
+def predict_tile(features, valid, limit):
+
+    return predict_features(_worker['regressor'], features, valid, limit)
+
+
+def predict_parallel(regressor, dataset, windows, limit, n_workers, mask_path=None,
+                     water_ratio=None):
+    """ Yield the prediction of each window in order, computed by a pool of processes """
+
+    regressor_pickle = pickle.dumps(regressor, pickle.HIGHEST_PROTOCOL)
+    pending = deque()
+
+    with ProcessPoolExecutor(n_workers, initializer=init_worker,
+                             initargs=(regressor_pickle, dataset.name, mask_path)) as executor:
+        for window in windows:
+            # keep every worker busy without queueing the whole image
+            if len(pending) >= 2 * n_workers:
+                yield pending.popleft().result()
+
+            pending.append(executor.submit(predict_worker, window, limit, water_ratio))
+
+        while pending:
+            yield pending.popleft().result()
+
+
+def predict_blocks(regressor, dataset, dst, limit=None,
+                   memory_budget=DEFAULT_MEMORY_BUDGET, progress=None, n_workers=1,
+                   mask_path=None, water_ratio=None):
+    """ Predict dataset window by window, writing each finished tile into dst
+
+    Returns the number of pixels that went through the regressor.
+    """
+
+    n_workers = resolve_workers(n_workers)
+
+    # the budget is shared by every tile in flight
+    windows = list(pixel_windows(dataset, memory_budget // (2 * n_workers)))
+
+    npredicted = 0
+
+    # the mask and the process pool are closed even when a tile fails or is cancelled
+    with contextlib.ExitStack() as stack:
+        if n_workers > 1 and len(windows) > 1:
+            tiles = stack.enter_context(contextlib.closing(predict_parallel(
+                regressor, dataset, windows, limit, min(n_workers, len(windows)),
+                mask_path, water_ratio)))
+        else:
+            mask = stack.enter_context(open_mask(mask_path, dataset))
+            tiles = (predict_window(regressor, dataset, window, limit, mask, water_ratio)
+                     for window in windows)
+
+        for i, (window, (z, count)) in enumerate(zip(windows, tiles)):
+            dst.write(z.reshape(1, window.height, window.width).astype(dst.dtypes[0], copy=False),
+                      window=window)
+            npredicted += count
+
+            if progress is not None:
+                progress(i + 1, len(windows))
+
+    return npredicted
+
+
+# end of a scene queue
+_DONE = object()
+
+
+def put_until(items, item, stop):
+    """ Put item into a bounded queue unless stop gets set while waiting """
+
+    while not stop.is_set():
+        try:
+            items.put(item, timeout=.1)
+            return True
+        except queue.Full:
+            pass
+
+    return False
+
+
+def get_until(items, stop):
+    """ Get the next item of a queue, or the end marker once stop gets set """
+
+    while not stop.is_set():
+        try:
+            return items.get(timeout=.1)
+        except queue.Empty:
+            pass
+
+    return _DONE
+
+
+def read_scenes(scenes, read_queue, stop, mask_path=None, water_ratio=None):
+    """ Producer reading the feature blocks of every scene in turn """
+
+    try:
+        for i, (path, windows) in enumerate(scenes):
+            with rio.open(path) as dataset, open_mask(mask_path, dataset) as mask:
+                for window in windows:
+                    features = read_pixels(dataset, window)
+                    valid = valid_pixels(dataset, window, features, mask, water_ratio)
+
+                    if not put_until(read_queue, (i, window, features, valid), stop):
+                        return
+
+        put_until(read_queue, _DONE, stop)
+    except BaseException as e:
+        put_until(read_queue, e, stop)
+
+
+def write_scenes(scenes, outputs, write_queue, stop, errors, on_scene=None):
+    """ Consumer writing predicted tiles, closing each output once all its tiles arrived """
+
+    remaining = [len(windows) for _, windows in scenes]
+    outputs_open = {}
+
+    try:
+        while True:
+            item = get_until(write_queue, stop)
+
+            if item is _DONE:
+                break
+
+            i, window, z = item
+
+            if i not in outputs_open:
+                with rio.open(scenes[i][0]) as dataset:
+                    outputs_open[i] = create_prediction(outputs[i], dataset)
+
+            dst = outputs_open[i]
+            dst.write(z.reshape(1, window.height, window.width).astype(dst.dtypes[0], copy=False),
+                      window=window)
+
+            remaining[i] -= 1
+            if not remaining[i]:
+                outputs_open.pop(i).close()
+
+                if on_scene is not None:
+                    on_scene(i)
+    except BaseException as e:
+        errors.append(e)
+        stop.set()
+    finally:
+        for dst in outputs_open.values():
+            dst.close()
+
+
+def predict_scenes(regressor, images, outputs, limit=None, memory_budget=DEFAULT_MEMORY_BUDGET,
+                   progress=None, mask_path=None, water_ratio=None, n_jobs=1, queue_size=4,
+                   on_scene=None):
+    """ Predict several images with one regressor into tiled GeoTIFFs at outputs
+
+    Reading runs a thread ahead of the prediction and writing a thread
+    behind it, linked by bounded queues of queue_size tiles, so the next
+    tile (of the same or the next scene) is read while the current one is
+    predicted and the previous one written. on_scene(i) is called from the
+    writer once output i is complete. Returns the predicted pixel counts.
+
+    Regressors predicting on one core get the tiles from the read queue
+    predicted by a pool of n_jobs processes, each unpickling the regressor
+    once, as in predict_blocks. Forests and gradient boosting predict in
+    this thread on n_jobs threads of their own.
+    """
+
+    n_workers = resolve_workers(n_jobs)
+    pooled = n_workers > 1 and not native_parallel(regressor)
+    in_flight = 2 * n_workers if pooled else 1
+
+    # the budget is shared by both queues and the tiles being predicted
+    scenes = []
+    for image in images:
+        with rio.open(image) as dataset:
+            scenes.append((image, list(pixel_windows(
+                dataset, memory_budget // (2 * queue_size + in_flight + 1)))))
+
+    total = sum(len(windows) for _, windows in scenes)
+    npredicted = [0] * len(scenes)
+
+    stop = threading.Event()
+    errors = []
+    read_queue = queue.Queue(queue_size)
+    write_queue = queue.Queue(queue_size)
+
+    reader = threading.Thread(target=read_scenes,
+                              args=(scenes, read_queue, stop, mask_path, water_ratio), daemon=True)
+    writer = threading.Thread(target=write_scenes,
+                              args=(scenes, outputs, write_queue, stop, errors, on_scene), daemon=True)
+    reader.start()
+    writer.start()
+
+    done = 0
+    pending = deque()
+
+    def write_next():
+        """ Hand the oldest predicted tile to the writer, False once stopped """
+
+        nonlocal done
+
+        i, window, tile = pending.popleft()
+        z, count = tile.result() if pooled else tile
+        npredicted[i] += count
+
+        if not put_until(write_queue, (i, window, z), stop):
+            return False
+
+        done += 1
+        if progress is not None:
+            progress(done, total)
+
+        return True
+
+    try:
+        with contextlib.ExitStack() as stack:
+            if pooled:
+                executor = stack.enter_context(ProcessPoolExecutor(
+                    n_workers, initializer=init_predictor,
+                    initargs=(pickle.dumps(regressor, pickle.HIGHEST_PROTOCOL),)))
+
+                # on errors and cancellation, drop queued tiles before the pool shuts down
+                stack.callback(lambda: [tile.cancel() for _, _, tile in pending])
+            else:
+                stack.enter_context(parallel_backend('threading', n_jobs=n_jobs))
+
+            writing = True
+            while writing:
+                item = get_until(read_queue, stop)
+
+                if item is _DONE:
+                    break
+                elif isinstance(item, BaseException):
+                    raise item
+
+                i, window, features, valid = item
+
+                if pooled:
+                    tile = executor.submit(predict_tile, features, valid, limit)
+                else:
+                    tile = predict_features(regressor, features, valid, limit)
+
+                pending.append((i, window, tile))
+
+                # keep every worker busy without queueing the whole scene
+                while writing and len(pending) >= in_flight:
+                    writing = write_next()
+
+            while writing and pending:
+                writing = write_next()
+
+        put_until(write_queue, _DONE, stop)
+        writer.join()
+
+        if errors:
+            raise errors[0]
+    finally:
+        stop.set()
+        reader.join()
+        writer.join()
+
+    return npredicted
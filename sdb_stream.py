@@ -0,0 +1,200 @@
+from sklearn.base import BaseEstimator, RegressorMixin, clone
+import numpy as np
+
+
+class IncrementalLinearRegression(RegressorMixin, BaseEstimator):
+    """ Least squares linear regression fitted chunk by chunk
+
+    partial_fit accumulates XᵀX and Xᵀy, so memory only depends on the
+    number of bands and the result equals an ordinary least squares fit
+    of all chunks at once. A positive alpha adds a ridge penalty on the
+    coefficients (not the intercept).
+    """
+
+    def __init__(self, fit_intercept=True, alpha=0.0):
+
+        self.fit_intercept = fit_intercept
+        self.alpha = alpha
+
+
+    def design(self, X):
+
+        X = np.asarray(X, dtype='float64')
+
+        if self.fit_intercept:
+            X = np.column_stack([X, np.ones(len(X))])
+
+        return X
+
+
+    def accumulate(self, X, y):
+        """ Add a chunk to XᵀX and Xᵀy without solving """
+
+        A = self.design(X)
+        y = np.asarray(y, dtype='float64')
+
+        if not hasattr(self, 'xtx_'):
+            self.xtx_ = np.zeros((A.shape[1], A.shape[1]))
+            self.xty_ = np.zeros(A.shape[1])
+            self.n_samples_seen_ = 0
+
+        self.xtx_ += A.T @ A
+        self.xty_ += A.T @ y
+        self.n_samples_seen_ += len(A)
+
+
+    def partial_fit(self, X, y):
+
+        self.accumulate(X, y)
+
+        return self.solve()
+
+
+    def solve(self):
+        """ Coefficients of the chunks accumulated so far """
+
+        xtx = self.xtx_
+        if self.alpha:
+            penalty = np.full(len(xtx), float(self.alpha))
+            if self.fit_intercept:
+                penalty[-1] = 0
+
+            xtx = xtx + np.diag(penalty)
+
+        coef = np.linalg.lstsq(xtx, self.xty_, rcond=None)[0]
+
+        if self.fit_intercept:
+            self.coef_, self.intercept_ = coef[:-1], coef[-1]
+        else:
+            self.coef_, self.intercept_ = coef, 0.0
+
+        return self
+
+
+    def fit(self, X, y):
+
+        for attribute in ('xtx_', 'xty_', 'n_samples_seen_'):
+            self.__dict__.pop(attribute, None)
+
+        return self.partial_fit(X, y)
+
+
+    def predict(self, X):
+
+        return np.asarray(X, dtype='float64') @ self.coef_ + self.intercept_
+
+
+class KernelApproximationRegression(RegressorMixin, BaseEstimator):
+    """ Ridge regression on an explicit kernel feature map, fitted chunk by chunk
+
+    kernel_map (e.g. RBFSampler or Nystroem) turns the bands into
+    n_components features approximating the kernel. Fit and predict
+    cost grows linearly with the samples instead of quadratically as
+    in kernel SVR. Only chunk_size rows are mapped at a time, so memory
+    depends on n_components, not on the number of samples or pixels.
+    """
+
+    def __init__(self, kernel_map, alpha=1.0, chunk_size=4096):
+
+        self.kernel_map = kernel_map
+        self.alpha = alpha
+        self.chunk_size = chunk_size
+
+
+    def fit(self, X, y):
+
+        X = np.asarray(X)
+        y = np.asarray(y, dtype='float64')
+
+        self.kernel_map_ = clone(self.kernel_map).fit(X)
+        self.linear_ = IncrementalLinearRegression(alpha=self.alpha)
+
+        for start in range(0, len(X), self.chunk_size):
+            self.linear_.accumulate(self.kernel_map_.transform(X[start:start + self.chunk_size]),
+                                    y[start:start + self.chunk_size])
+
+        self.linear_.solve()
+
+        return self
+
+
+    def predict(self, X):
+
+        X = np.asarray(X)
+        z = np.empty(len(X))
+
+        for start in range(0, len(X), self.chunk_size):
+            z[start:start + self.chunk_size] = self.linear_.predict(
+                self.kernel_map_.transform(X[start:start + self.chunk_size]))
+
+        return z
+
+
+class StreamingScores(object):
+    """ RMSE, MAE and R² accumulated over chunks of test data """
+
+    def __init__(self):
+
+        self.n = 0
+        self.sum_squared = 0.0
+        self.sum_absolute = 0.0
+        self.sum_z = 0.0
+        self.sum_z2 = 0.0
+
+
+    def update(self, z_test, z_validate):
+
+        z_test = np.asarray(z_test, dtype='float64')
+        error = z_test - z_validate
+
+        self.n += len(z_test)
+        self.sum_squared += np.dot(error, error)
+        self.sum_absolute += np.abs(error).sum()
+        self.sum_z += z_test.sum()
+        self.sum_z2 += np.dot(z_test, z_test)
+
+
+    def scores(self):
+
+        total = self.sum_z2 - self.sum_z ** 2 / self.n
+
+        return (
+            np.sqrt(self.sum_squared / self.n),
+            self.sum_absolute / self.n,
+            1 - self.sum_squared / total
+        )
+
+
+def stream_chunks(chunks, depth_label, start_label, end_label, train_percent, limit=None):
+    """ Yield (features_train, features_test, z_train, z_test) for every chunk of samples
+
+    Like split_samples, but the depth sign is decided on the first chunk
+    and rows go to the test data at random with a fixed seed, so every
+    pass over the same chunks yields the same split.
+    """
+
+    random = np.random.default_rng(0)
+    flip = None
+
+    for chunk in chunks:
+        z = chunk[depth_label]
+
+        if flip is None:
+            flip = (z > 0).sum() > z.count() / 2
+
+        if flip:
+            z = z * -1
+
+        keep = z.notna()
+        if limit is not None:
+            keep &= (z >= limit) & (z <= 0)
+
+        start_loc = chunk.columns.get_loc(start_label)
+        end_loc = chunk.columns.get_loc(end_label)
+
+        features = chunk.iloc[:, start_loc:end_loc+1][keep.to_numpy()].to_numpy()
+        z = z[keep].to_numpy()
+
+        test = random.random(len(z)) < (100 - train_percent) / 100
+
+        yield features[~test], features[test], z[~test], z[test]